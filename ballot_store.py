@@ -0,0 +1,1141 @@
+# Copyright (C) 2022 Michelle Blom
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+from collections.abc import Mapping
+from multiprocessing import shared_memory
+
+import hashlib
+import threading
+
+import numpy as np
+
+
+def rank_dtype(ncands):
+    '''
+    Returns the smallest signed integer type able to hold the index of any
+    of 'ncands' candidates, as well as the padding value -1.
+    '''
+    return np.int8 if ncands < 128 else np.int16
+
+
+class BallotStore:
+    """
+    Columnar representation of the ballots cast in a single contest.
+
+    Candidates are interned to small integers: their position in the list
+    'candidates'. Each row of the rank matrix 'ranks' describes one ballot,
+    with ranks[b][p] holding the index of the candidate in position 'p' of
+    the ranking on ballot 'b'. Positions that do not hold a candidate of
+    this contest (padding, unrecognised identifiers, or repeated mentions of
+    a candidate) hold the value -1.
+
+    Ballot identifiers, if known, are stored as integers in 'ballot_ids'.
+
+    In a weighted store, each row instead describes a ballot signature (a
+    distinct ranking), and 'weights' gives the number of ballots cast with
+    that signature. Ballot identifiers are not kept for weighted stores.
+    """
+
+    def __init__(self, candidates, ranks, ballot_ids=None, weights=None):
+        self.candidates = list(candidates)
+
+        # Map between candidate identifier and its interned index.
+        self.index = {c : i for i,c in enumerate(self.candidates)}
+
+        self.ranks = ranks
+        self.ballot_ids = ballot_ids
+        self.weights = weights
+
+        # For each candidate, the rows of 'ranks' on which it appears
+        # (built on first use; see rows_ranking).
+        self._rows_ranking = None
+
+    @property
+    def ncands(self):
+        return len(self.candidates)
+
+    @property
+    def nballots(self):
+        # Number of rows in the rank matrix.
+        return self.ranks.shape[0]
+
+    @property
+    def total(self):
+        # Number of ballots represented by the store.
+        return self.nballots if self.weights is None else \
+            int(self.weights.sum())
+
+    @property
+    def depth(self):
+        return self.ranks.shape[1]
+
+    @classmethod
+    def from_ballots(cls, candidates, ballots, ballot_ids=None):
+        '''
+        Build a store from a sequence of ballots in the dictionary
+        representation used by the legacy 'cvrs' structure, mapping
+        candidate identifier to position in the ranking.
+        '''
+        index = {c : i for i,c in enumerate(candidates)}
+
+        ballots = list(ballots)
+        depth = max([max(b.values()) + 1 for b in ballots if b], default=0)
+
+        ranks = np.full((len(ballots), depth), -1, \
+            dtype=rank_dtype(len(candidates)))
+
+        for i,blt in enumerate(ballots):
+            for c,pos in blt.items():
+                if c in index:
+                    ranks[i, pos] = index[c]
+
+        ids = None if ballot_ids is None else \
+            np.asarray(ballot_ids, dtype=np.int64)
+
+        return cls(candidates, ranks, ballot_ids=ids)
+
+    @classmethod
+    def from_cvrs(cls, contest, cvrs):
+        '''
+        Build a store holding the ballots in the legacy 'cvrs' mapping (of
+        ballot id to a mapping between contest and ballot) that are relevant
+        to the given 'contest'.
+        '''
+        ballots = [blt[contest.name] for _,blt in cvrs.items()
+            if contest.name in blt]
+
+        return cls.from_ballots(contest.candidates, ballots)
+
+    def digest(self):
+        '''
+        Returns a hash (as a hexadecimal string) of the candidates, rankings
+        and weights in this store.
+        '''
+        h = hashlib.sha256(repr(self.candidates).encode("utf-8"))
+
+        for arr in (self.ranks, self.weights):
+            if arr is None:
+                h.update(b"-")
+                continue
+
+            arr = np.ascontiguousarray(arr)
+            h.update(repr((arr.dtype.str, arr.shape)).encode("utf-8"))
+            h.update(arr.data)
+
+        return h.hexdigest()
+
+    def ballot(self, i):
+        '''
+        Returns ballot 'i' in the legacy dictionary representation, mapping
+        candidate identifier to their position in the ranking.
+        '''
+        pos = {c : p for p,c in enumerate(self.ranks[i].tolist()) if c != -1}
+
+        return {self.candidates[c] : pos[c] for c in sorted(pos)}
+
+    def collapse(self):
+        '''
+        Returns a weighted store with one row per distinct ranking in this
+        store.
+        '''
+        if self.nballots == 0:
+            return BallotStore(self.candidates, self.ranks, \
+                weights=np.zeros(0, dtype=np.int64))
+
+        ranks, inverse = np.unique(self.ranks, axis=0, return_inverse=True)
+
+        weights = np.bincount(inverse.ravel(), weights=self.weights, \
+            minlength=ranks.shape[0]).astype(np.int64)
+
+        return BallotStore(self.candidates, ranks, weights=weights)
+
+    def _count(self, rows):
+        # Number of ballots described by the rows selected by the boolean
+        # vector 'rows'.
+        if self.weights is None:
+            return int(np.count_nonzero(rows))
+
+        return int(self.weights[rows].sum())
+
+    def _bincount(self, cands, rows, minlength=None):
+        # Number of ballots, per candidate, described by the rows selected by
+        # the boolean vector 'rows', where each of these rows is counted
+        # towards the candidate given in 'cands'.
+        weights = None if self.weights is None else self.weights[rows]
+
+        return np.bincount(cands[rows], weights=weights, minlength=\
+            self.ncands if minlength is None else minlength).astype(np.int64)
+
+    def mask(self, cands):
+        '''
+        Returns a boolean vector, indexed by candidate, that is True for
+        each of the candidate identifiers in 'cands'.
+        '''
+        mask = np.zeros(self.ncands, dtype=bool)
+        mask[[self.index[c] for c in cands]] = True
+        return mask
+
+    def bitmask(self, cands):
+        '''
+        Returns an integer with bit 'i' set for each candidate in 'cands',
+        where 'i' is the candidate's interned index.
+        '''
+        bits = 0
+        for c in cands:
+            bits |= 1 << self.index[c]
+        return bits
+
+    def bits_to_mask(self, bits):
+        '''
+        Returns the boolean vector, indexed by candidate, corresponding to
+        the integer bitmask 'bits'.
+        '''
+        return np.array([(bits >> i) & 1 for i in range(self.ncands)], \
+            dtype=bool)
+
+    def first_preferences(self):
+        '''
+        Returns a vector, indexed by candidate, of first preference tallies.
+        '''
+        if self.depth == 0:
+            return np.zeros(self.ncands, dtype=np.int64)
+
+        first = self.ranks[:, 0]
+        return self._bincount(first, first != -1)
+
+    def neb_tallies(self):
+        '''
+        Computes the tallies needed to form all Not-Eliminated-Before
+        assertions for the contest, in one pass over the columns of the
+        rank matrix.
+
+        Output:
+            Returns a pair (first, above). 'first' is a vector, indexed by
+            candidate, of first preference tallies. 'above' is a matrix
+            where above[w][l] is the number of ballots on which 'l' is
+            ranked, and on which 'w' is either not ranked or ranked below
+            'l' (the maximum tally 'l' can have while 'w' is standing).
+        '''
+        C = self.ncands
+
+        first = self.first_preferences()
+
+        # Number of ballots on which each candidate is ranked.
+        mentions = np.zeros(C, dtype=np.int64)
+
+        # before[x*C + y] is the number of ballots ranking both 'x' and 'y',
+        # with 'x' ranked higher.
+        before = np.zeros(C*C, dtype=np.int64)
+
+        ranks = self.ranks.astype(np.int64)
+        for i in range(self.depth):
+            x = ranks[:, i]
+            mentions += self._bincount(x, x != -1)
+
+            for j in range(i+1, self.depth):
+                y = ranks[:, j]
+                both = (x != -1) & (y != -1)
+                before += self._bincount(x*C + y, both, minlength=C*C)
+
+        above = mentions[np.newaxis, :] - before.reshape((C, C))
+        np.fill_diagonal(above, 0)
+
+        return first, above
+
+    def top_choices(self, continuing):
+        '''
+        Input:
+            continuing  -   boolean vector, indexed by candidate, indicating
+                            which candidates are still standing.
+
+        Output:
+            Returns a vector giving, for each ballot, the index of the most
+            preferred continuing candidate on that ballot, or -1 if the
+            ballot ranks none of the continuing candidates.
+        '''
+        if self.depth == 0:
+            return np.full(self.nballots, -1, dtype=self.ranks.dtype)
+
+        # The padding value -1 indexes the final (False) entry of 'keep'.
+        keep = np.append(np.asarray(continuing, dtype=bool), False)
+        live = keep[self.ranks]
+
+        first = live.argmax(axis=1)
+        rows = np.arange(self.nballots)
+
+        return np.where(live[rows, first], self.ranks[rows, first], -1)
+
+    def rows_ranking(self, c):
+        '''
+        Returns the (sorted) indices of the rows of the rank matrix that
+        mention the candidate with interned index 'c'.
+        '''
+        if self._rows_ranking is None:
+            flat = np.flatnonzero(self.ranks.ravel() != -1)
+            cands = self.ranks.ravel()[flat]
+
+            order = np.argsort(cands, kind='stable')
+            counts = np.bincount(cands, minlength=self.ncands)
+
+            self._rows_ranking = np.split(flat[order] // max(self.depth, 1),\
+                np.cumsum(counts)[:-1])
+
+        return self._rows_ranking[c]
+
+    def subset(self, rows):
+        '''
+        Returns a store holding the given rows of this store.
+        '''
+        return BallotStore(self.candidates, self.ranks[rows], \
+            weights=None if self.weights is None else self.weights[rows])
+
+    def tally(self, continuing):
+        '''
+        Input:
+            continuing  -   boolean vector, indexed by candidate, indicating
+                            which candidates are still standing.
+
+        Output:
+            Returns a vector, indexed by candidate, giving the number of
+            ballots on which each candidate is the most preferred of the
+            continuing candidates. Eliminated candidates have a tally of 0.
+        '''
+        top = self.top_choices(continuing)
+
+        return self._bincount(top, top != -1)
+
+    def child_tally(self, continuing, parent_tally, cand):
+        '''
+        Input:
+            continuing    -   boolean vector, indexed by candidate,
+                              indicating which candidates are still
+                              standing. Includes the candidate 'cand'.
+
+            parent_tally  -   vector of candidate tallies when 'cand' has
+                              also been eliminated.
+
+            cand          -   interned index of a continuing candidate.
+
+        Output:
+            Returns the vector of candidate tallies when the candidates in
+            'continuing' are standing. Restoring 'cand' only changes the
+            votes of ballots that rank 'cand', so only those ballots are
+            recounted.
+        '''
+        affected = self.subset(self.rows_ranking(cand))
+
+        top = affected.top_choices(continuing)
+        moved = top == cand
+
+        without = np.array(continuing, dtype=bool)
+        without[cand] = False
+
+        prev = affected.top_choices(without)
+
+        tally = parent_tally - affected._bincount(prev, moved & (prev != -1))
+        tally[cand] += affected._count(moved)
+
+        return tally
+
+    def tabulate_irv(self):
+        '''
+        Tabulate the ballots by instant runoff. Each ballot keeps a pointer
+        to its most preferred continuing candidate, and ballots are kept in
+        piles by that candidate. When a candidate is eliminated, only the
+        ballots in their pile are moved, each to its next continuing
+        preference.
+
+        Of the candidates tied for elimination, the one with the lowest
+        interned index is eliminated.
+
+        Output:
+            Returns a pair (order, rounds). 'order' lists the interned
+            indices of the candidates in the order in which they are
+            eliminated, ending with the winner. rounds[r] is the vector of
+            tallies, indexed by candidate, at the start of round 'r' (in
+            which order[r] is eliminated). Eliminated candidates have a
+            tally of 0.
+        '''
+        C = self.ncands
+        D = self.depth
+
+        # A column of padding is added, so that a pointer past the last
+        # preference of a ballot reads -1.
+        ranks = np.concatenate([self.ranks, np.full((self.nballots, 1), -1, \
+            dtype=self.ranks.dtype)], axis=1)
+
+        # The padding value -1 indexes the final (False) entry of 'keep'.
+        keep = np.append(np.ones(C, dtype=bool), False)
+
+        pos = np.full(self.nballots, -1, dtype=np.int64)
+        tally = np.zeros(C, dtype=np.int64)
+
+        # Ballots whose most preferred continuing candidate is 'c', as a
+        # list of arrays of rows (concatenated when 'c' is eliminated).
+        piles = [[] for c in range(C)]
+
+        def redistribute(rows):
+            # Move each ballot in 'rows' to its next continuing preference.
+            p = pos[rows]
+            pending = np.arange(len(rows))
+            while len(pending) > 0:
+                p[pending] += 1
+                cands = ranks[rows[pending], p[pending]]
+                pending = pending[~keep[cands] & (p[pending] < D)]
+
+            pos[rows] = p
+
+            # Exhausted ballots (those with no continuing preference left)
+            # leave the count.
+            cands = ranks[rows, p].astype(np.int64)
+            live = cands != -1
+            rows = rows[live]
+            cands = cands[live]
+
+            weights = None if self.weights is None else self.weights[rows]
+            tally[:] += np.bincount(cands, weights=weights, \
+                minlength=C).astype(np.int64)
+
+            rows = rows[np.argsort(cands, kind='stable')]
+            counts = np.bincount(cands, minlength=C)
+            ends = np.cumsum(counts)
+            for c in np.flatnonzero(counts):
+                piles[c].append(rows[ends[c]-counts[c]:ends[c]])
+
+        redistribute(np.arange(self.nballots))
+
+        order = []
+        rounds = []
+
+        for r in range(C - 1):
+            rounds.append(tally.copy())
+
+            standing = np.flatnonzero(keep[:C])
+            toelim = int(standing[np.argmin(tally[standing])])
+
+            order.append(toelim)
+            keep[toelim] = False
+            tally[toelim] = 0
+
+            if piles[toelim]:
+                redistribute(np.concatenate(piles[toelim]))
+                piles[toelim] = []
+
+        order.extend(np.flatnonzero(keep[:C]).tolist())
+
+        return order, rounds
+
+
+class BallotTrie:
+    """
+    Tally backend that holds the ballots of a BallotStore as a weighted
+    prefix trie of rankings. Ballots that share a prefix share the nodes
+    for that prefix, and each node records the number of ballots passing
+    through it.
+
+    The trie is stored level by level: for the nodes at depth 'k',
+    cands[k] gives each node's candidate, weights[k] the number of ballots
+    through it, and child_start[k]/child_end[k] the range of its children
+    among the nodes at depth k+1.
+
+    A BallotTrie can be used in place of the BallotStore it was built from
+    by find_best_audit, compute_raire_assertions, sim_irv and
+    simple_IRV_assertions. Queries other than tallies are answered by the
+    underlying store.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+        C = store.ncands
+
+        # Positions that do not hold a candidate play no part in tallies.
+        # Drop them, moving the remaining preferences of each ballot to the
+        # front, and merge ballots with the same ranking.
+        order = np.argsort(store.ranks == -1, axis=1, kind='stable')
+        compact = np.take_along_axis(store.ranks, order, axis=1)
+
+        sigs = BallotStore(store.candidates, compact, \
+            weights=store.weights).collapse()
+
+        # Signatures are sorted, so those sharing a prefix are adjacent.
+        rows = sigs.ranks.astype(np.int64)
+        nrows = rows.shape[0]
+
+        self.cands = []
+        self.weights = []
+        self.child_start = []
+        self.child_end = []
+
+        # Flags rows whose prefix (so far) differs from the previous row.
+        differs = np.arange(nrows) == 0
+        parents = None
+
+        for k in range(rows.shape[1]):
+            col = rows[:, k]
+            present = col != -1
+            if not present.any():
+                break
+
+            differs = differs | (col != np.roll(col, 1))
+            starts = present & differs
+
+            # Node, at this depth, reached by each row.
+            node = np.cumsum(starts) - 1
+
+            self.cands.append(col[starts])
+            self.weights.append(np.bincount(node[present], \
+                weights=sigs.weights[present]).astype(np.int64))
+
+            if parents is not None:
+                parent = parents[starts]
+                nparents = len(self.cands[-2])
+
+                self.child_start.append(np.searchsorted(parent, \
+                    np.arange(nparents), side='left'))
+                self.child_end.append(np.searchsorted(parent, \
+                    np.arange(nparents), side='right'))
+
+            parents = node
+
+        if self.cands:
+            nleaves = len(self.cands[-1])
+            self.child_start.append(np.zeros(nleaves, dtype=np.int64))
+            self.child_end.append(np.zeros(nleaves, dtype=np.int64))
+
+    @property
+    def candidates(self):
+        return self.store.candidates
+
+    @property
+    def index(self):
+        return self.store.index
+
+    @property
+    def ncands(self):
+        return self.store.ncands
+
+    @property
+    def total(self):
+        return self.store.total
+
+    @property
+    def nnodes(self):
+        # Number of nodes in the trie.
+        return sum([len(c) for c in self.cands])
+
+    def mask(self, cands):
+        return self.store.mask(cands)
+
+    def bitmask(self, cands):
+        return self.store.bitmask(cands)
+
+    def bits_to_mask(self, bits):
+        return self.store.bits_to_mask(bits)
+
+    def digest(self):
+        return self.store.digest()
+
+    def first_preferences(self):
+        return self.store.first_preferences()
+
+    def neb_tallies(self):
+        return self.store.neb_tallies()
+
+    def _children(self, k, nodes):
+        # Indices, among the nodes at depth k+1, of the children of the
+        # given nodes at depth 'k'.
+        start = self.child_start[k][nodes]
+        lengths = self.child_end[k][nodes] - start
+
+        offsets = np.cumsum(lengths) - lengths
+        return np.arange(lengths.sum()) + np.repeat(start - offsets, lengths)
+
+    def _walk(self, keep, k, active, tally, hits=None):
+        # Walk down the trie from the nodes 'active' at depth 'k'. The walk
+        # stops at each node whose candidate is flagged in 'keep', adding
+        # the number of ballots through it to 'tally' (and, if 'hits' is
+        # given, appending the depth and indices of these nodes to it), and
+        # descends below every other node.
+        while len(active) > 0:
+            cands = self.cands[k][active]
+            hit = keep[cands]
+
+            tally += np.bincount(cands[hit], weights=self.weights[k][\
+                active[hit]], minlength=self.ncands).astype(np.int64)
+
+            if hits is not None:
+                hits.append((k, active[hit]))
+
+            active = self._children(k, active[~hit])
+            k += 1
+
+    def tally(self, continuing):
+        '''
+        Input:
+            continuing  -   boolean vector, indexed by candidate, indicating
+                            which candidates are still standing.
+
+        Output:
+            Returns a vector, indexed by candidate, giving the number of
+            ballots on which each candidate is the most preferred of the
+            continuing candidates. The trie is walked from the root, and
+            no node below a continuing candidate is visited.
+        '''
+        keep = np.asarray(continuing, dtype=bool)
+        tally = np.zeros(self.ncands, dtype=np.int64)
+
+        if self.cands:
+            self._walk(keep, 0, np.arange(len(self.cands[0])), tally)
+
+        return tally
+
+    def child_tally(self, continuing, parent_tally, cand):
+        '''
+        A walk of the trie already stops at the first continuing candidate
+        on each path, so child tallies are found with a fresh walk; a walk
+        confined to the ballots that move to 'cand' visits as many nodes
+        (see BallotStore.child_tally). TallyCache does not call this method
+        for a BallotTrie.
+        '''
+        return self.tally(continuing)
+
+    def tabulate_irv(self):
+        '''
+        Tabulate the ballots by instant runoff (see BallotStore.tabulate_irv,
+        which gives the form of the output and the breaking of ties). The
+        ballots in the pile of each candidate are held as the trie nodes
+        through which they reach that candidate. When a candidate is
+        eliminated, only the subtries below the nodes in their pile are
+        walked, to move their ballots on.
+        '''
+        C = self.ncands
+
+        keep = np.ones(C, dtype=bool)
+        tally = np.zeros(C, dtype=np.int64)
+
+        # Pile of each candidate, as a dictionary mapping depth to a list of
+        # arrays of node indices at that depth.
+        piles = [{} for c in range(C)]
+
+        def redistribute(starts):
+            # Walk down from the nodes in 'starts' (a dictionary mapping
+            # depth to a list of arrays of node indices), a depth at a time,
+            # moving the ballots through them to the first node for a
+            # continuing candidate at or below them.
+            empty = np.zeros(0, dtype=np.int64)
+
+            active = empty
+            k = min(starts, default=len(self.cands))
+
+            while k < len(self.cands) and (len(active) > 0 or starts):
+                if k in starts:
+                    active = np.concatenate([active] + starts.pop(k))
+
+                if len(active) > 0:
+                    cands = self.cands[k][active]
+                    hit = keep[cands]
+
+                    nodes = active[hit]
+                    cands = cands[hit]
+
+                    tally[:] += np.bincount(cands, weights=self.weights[k][\
+                        nodes], minlength=C).astype(np.int64)
+
+                    nodes = nodes[np.argsort(cands, kind='stable')]
+                    counts = np.bincount(cands, minlength=C)
+                    ends = np.cumsum(counts)
+                    for c in np.flatnonzero(counts):
+                        piles[c].setdefault(k, []).append(\
+                            nodes[ends[c]-counts[c]:ends[c]])
+
+                    active = self._children(k, active[~hit])
+
+                k += 1
+
+        if self.cands:
+            redistribute({0 : [np.arange(len(self.cands[0]))]})
+
+        order = []
+        rounds = []
+
+        for r in range(C - 1):
+            rounds.append(tally.copy())
+
+            standing = np.flatnonzero(keep)
+            toelim = int(standing[np.argmin(tally[standing])])
+
+            order.append(toelim)
+            keep[toelim] = False
+            tally[toelim] = 0
+
+            redistribute({d+1 : [self._children(d, np.concatenate(nodes))] \
+                for d, nodes in piles[toelim].items()})
+
+            piles[toelim] = {}
+
+        order.extend(np.flatnonzero(keep).tolist())
+
+        return order, rounds
+
+
+class BallotStoreBuilder:
+    """
+    Accumulates ballots for a single contest, row by row, and produces a
+    BallotStore. Rows are buffered in blocks of 'block_size' ballots that
+    are converted to arrays as they fill, so that the full set of ballots
+    is never held as Python objects.
+
+    If 'weighted' is True, the builder produces a weighted store with one
+    row per distinct ranking, and ballot ids are not recorded.
+    """
+
+    def __init__(self, candidates, with_ids=True, weighted=False, \
+        block_size=65536):
+        self.candidates = list(candidates)
+        self.index = {c : i for i,c in enumerate(self.candidates)}
+        self.dtype = rank_dtype(len(self.candidates))
+        self.with_ids = with_ids and not weighted
+        self.weighted = weighted
+        self.block_size = block_size
+
+        self.blocks = []
+        self.ids = []
+        self.weights = []
+
+        self.rows = []
+        self.row_ids = []
+        self.row_weights = []
+
+    def add(self, prefs, ballot_id=None, count=1):
+        '''
+        Add 'count' ballots whose ranking is given by the list of candidate
+        identifiers 'prefs' (most preferred first). If the builder records
+        ballot ids, these ballots are given the ids ballot_id, ballot_id+1,
+        and so on.
+        '''
+        row = []
+        seen = set()
+        for p in prefs:
+            c = self.index.get(p, -1)
+
+            # Only the first mention of a candidate is counted.
+            if c in seen:
+                c = -1
+            elif c != -1:
+                seen.add(c)
+
+            row.append(c)
+
+        if self.weighted:
+            self.rows.append(row)
+            self.row_weights.append(count)
+
+            if len(self.rows) >= self.block_size:
+                self._flush()
+
+            return
+
+        for i in range(count):
+            self.rows.append(row)
+            if self.with_ids:
+                self.row_ids.append(ballot_id + i)
+
+            if len(self.rows) >= self.block_size:
+                self._flush()
+
+    def _flush(self):
+        if not self.rows:
+            return
+
+        depth = max([len(r) for r in self.rows])
+        block = np.full((len(self.rows), depth), -1, dtype=self.dtype)
+        for i,row in enumerate(self.rows):
+            block[i, :len(row)] = row
+
+        self.blocks.append(block)
+        if self.with_ids:
+            self.ids.append(np.array(self.row_ids, dtype=np.int64))
+
+        if self.weighted:
+            # Collapse repeated signatures as each block is completed.
+            block = BallotStore(self.candidates, block, weights=np.array(\
+                self.row_weights, dtype=np.int64)).collapse()
+
+            self.blocks[-1] = block.ranks
+            self.weights.append(block.weights)
+
+        self.rows = []
+        self.row_ids = []
+        self.row_weights = []
+
+    def absorb(self, other, id_map=None):
+        '''
+        Append the ballots accumulated by the builder 'other' (for the same
+        candidates) to those of this builder, as if they had been added to
+        this builder in order. If given, the array 'id_map' translates
+        interned (negative) ballot ids of 'other': id -k becomes
+        id_map[k-1].
+        '''
+        self._flush()
+        other._flush()
+
+        self.blocks.extend(other.blocks)
+        self.weights.extend(other.weights)
+
+        for ids in other.ids:
+            if id_map is not None:
+                named = ids < 0
+                ids = ids.copy()
+                ids[named] = id_map[-ids[named]-1]
+
+            self.ids.append(ids)
+
+        other.blocks = []
+        other.ids = []
+        other.weights = []
+
+    def build(self):
+        self._flush()
+
+        depth = max([b.shape[1] for b in self.blocks], default=0)
+        ranks = np.full((sum([b.shape[0] for b in self.blocks]), depth), -1,\
+            dtype=self.dtype)
+
+        start = 0
+        for block in self.blocks:
+            ranks[start:start+block.shape[0], :block.shape[1]] = block
+            start += block.shape[0]
+
+        ids = None
+        if self.with_ids:
+            ids = np.concatenate(self.ids) if self.ids else \
+                np.zeros(0, dtype=np.int64)
+
+            # As in the dictionary representation, a later record for the
+            # same ballot replaces an earlier one.
+            uniq, last = np.unique(ids[::-1], return_index=True)
+            if len(uniq) < len(ids):
+                keep = np.sort(len(ids) - 1 - last)
+                ranks = ranks[keep]
+                ids = ids[keep]
+
+        self.blocks = []
+        self.ids = []
+
+        if self.weighted:
+            weights = np.concatenate(self.weights) if self.weights else \
+                np.zeros(0, dtype=np.int64)
+            self.weights = []
+
+            return BallotStore(self.candidates, ranks, \
+                weights=weights).collapse()
+
+        return BallotStore(self.candidates, ranks, ballot_ids=ids)
+
+
+class CVRStore(Mapping):
+    """
+    The per-contest BallotStores loaded from a single data file.
+
+    A CVRStore can be used wherever the legacy 'cvrs' structure is expected:
+    it is a read-only mapping between ballot id and a mapping of contest to
+    ballot, with each ballot a mapping of candidate to ranking position.
+    These dictionaries are created on demand.
+
+    Ballot ids are stored as integers. Non-negative ids are the numeric ids
+    from the data file, converted back to their original form with
+    'ballot_key'. Identifiers that are not numbers are interned, with
+    negative ids, through the table 'ballot_names'. The ballots of stores
+    without ballot ids (such as weighted stores) are given the ids 0, 1, ...
+    in order, numbered on from one such store to the next, so that the
+    ballots of different contests are never taken to be the same ballot.
+    """
+
+    def __init__(self, stores, ballot_names=None, ballot_key=str):
+        self.stores = stores
+        self.ballot_names = ballot_names if ballot_names != None else []
+        self.ballot_key = ballot_key
+
+        self._rows = None
+
+    def bid_to_key(self, bid):
+        return self.ballot_key(bid) if bid >= 0 else \
+            self.ballot_names[-bid-1]
+
+    def _index(self):
+        # Map between ballot id and the rows that hold it in each store.
+        if self._rows is None:
+            self._rows = {}
+
+            # First id given to the ballots of the next store without ids.
+            start = 0
+
+            for cid,store in self.stores.items():
+                for row,bid in self._ballots(store, start):
+                    key = self.bid_to_key(bid)
+                    if not key in self._rows:
+                        self._rows[key] = [(cid, row)]
+                    else:
+                        self._rows[key].append((cid, row))
+
+                if store.ballot_ids is None:
+                    start += store.total
+
+        return self._rows
+
+    def _ballots(self, store, start=0):
+        # Pairs of (row, ballot id) for each ballot in the given store. The
+        # ballots of a store without ballot ids are given the ids 'start',
+        # 'start' + 1, ...
+        if store.ballot_ids is not None:
+            return enumerate(store.ballot_ids.tolist())
+
+        weights = np.ones(store.nballots, dtype=np.int64) if \
+            store.weights is None else store.weights
+
+        return zip(np.repeat(np.arange(store.nballots), weights).tolist(), \
+            range(start, start + store.total))
+
+    def __getitem__(self, key):
+        return {cid : self.stores[cid].ballot(row) for cid,row in \
+            self._index()[key]}
+
+    def __iter__(self):
+        return iter(self._index())
+
+    def __len__(self):
+        return len(self._index())
+
+
+class BallotIdTable:
+    """
+    Converts the textual ballot ids of a data file to integers, as
+    described in CVRStore.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.lookup = {}
+
+    def intern(self, bid):
+        # Only plain ASCII numerals that round trip through int (no leading
+        # zeros, and small enough for an int64) are stored as their value.
+        # Other digits, such as '²' or '٣', are names like any other.
+        if bid.isascii() and bid.isdigit() and len(bid) <= 18 and \
+            (bid[0] != '0' or bid == '0'):
+            return int(bid)
+
+        if not bid in self.lookup:
+            self.names.append(bid)
+            self.lookup[bid] = -len(self.names)
+
+        return self.lookup[bid]
+
+
+class SharedBallotStore:
+    """
+    A copy of the arrays of a BallotStore in shared memory, so that worker
+    processes can read the ballots of a contest without them being pickled
+    for each task. Pickling a SharedBallotStore transfers only the names
+    and layout of its shared memory blocks; a worker calls attach() to
+    obtain a BallotStore over the shared arrays.
+
+    The creating process must call unlink() once all workers are done.
+    """
+
+    ARRAYS = ("ranks", "ballot_ids", "weights")
+
+    def __init__(self, store):
+        self.candidates = store.candidates
+
+        # Array name -> (shared memory block name, shape, dtype)
+        self.layout = {}
+        self.blocks = []
+
+        for name in SharedBallotStore.ARRAYS:
+            arr = getattr(store, name)
+            if arr is None:
+                continue
+
+            shm = shared_memory.SharedMemory(create=True, \
+                size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, arr.dtype, buffer=shm.buf)[...] = arr
+
+            self.layout[name] = (shm.name, arr.shape, arr.dtype.str)
+            self.blocks.append(shm)
+
+    def __getstate__(self):
+        return {"candidates" : self.candidates, "layout" : self.layout, \
+            "blocks" : []}
+
+    def attach(self):
+        '''
+        Returns a (read-only) BallotStore over the shared arrays.
+        '''
+        arrays = {}
+        for name, (shm_name, shape, dtype) in self.layout.items():
+            shm = shared_memory.SharedMemory(name=shm_name)
+            self.blocks.append(shm)
+
+            arr = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+            arr.flags.writeable = False
+            arrays[name] = arr
+
+        return BallotStore(self.candidates, arrays["ranks"], \
+            ballot_ids=arrays.get("ballot_ids"), weights=arrays.get("weights"))
+
+    def unlink(self):
+        '''
+        Release the shared memory blocks (creating process only).
+        '''
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+
+        self.blocks = []
+
+
+def contest_ballots(contest, cvrs):
+    '''
+    Returns a BallotStore holding the ballots relevant to the given
+    'contest'. The input 'cvrs' may be a BallotStore (or BallotTrie) for
+    the contest, a CVRStore, or a mapping in the legacy dictionary
+    representation.
+    '''
+    if isinstance(cvrs, (BallotStore, BallotTrie)):
+        return cvrs
+
+    if isinstance(cvrs, CVRStore):
+        return cvrs.stores[contest.name]
+
+    return BallotStore.from_cvrs(contest, cvrs)
+
+
+class TallyCache:
+    """
+    Memoizes the tallies of a contest's candidates for the sets of
+    continuing candidates considered during a search. Tallies depend only
+    on which candidates are continuing, so each entry is keyed by the
+    bitmask of continuing candidates (see BallotStore.bitmask), and stores
+    the full vector of candidate tallies.
+
+    The cache holds at most 'max_bytes' bytes of entries (approximately),
+    evicting the least recently used entries once this is exceeded. It may
+    be shared by threads evaluating nodes concurrently; tallies are then
+    computed outside of the cache's lock.
+    """
+
+    # Approximate memory, in bytes, used by an entry besides its tallies.
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self, ballots, max_bytes=64*2**20):
+        self.ballots = ballots
+        self.max_bytes = max_bytes
+
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.derived = 0
+        self.evictions = 0
+
+        # Number of ballot rows (or trie nodes, for a BallotTrie) scanned
+        # to compute the tallies not found in the cache.
+        self.scanned = 0
+
+    def tally(self, bits, parent_tally=None, cand=None):
+        '''
+        Returns the vector of candidate tallies when the candidates in the
+        bitmask 'bits' are the continuing candidates.
+
+        If these tallies are not in the cache, and 'parent_tally' gives the
+        tallies for the same set of continuing candidates less the
+        candidate with interned index 'cand', they are derived from
+        'parent_tally' (see BallotStore.child_tally) rather than recounted
+        over all ballots. For a BallotTrie, they are always found with a
+        fresh walk of the trie (see BallotTrie.child_tally).
+        '''
+        if isinstance(self.ballots, BallotTrie):
+            parent_tally = None
+
+        with self.lock:
+            tallies = self.entries.get(bits)
+
+            if tallies is not None:
+                self.entries.move_to_end(bits)
+                self.hits += 1
+                return tallies
+
+            self.misses += 1
+            if parent_tally is not None:
+                self.derived += 1
+
+        mask = self.ballots.bits_to_mask(bits)
+        if parent_tally is not None:
+            tallies = self.ballots.child_tally(mask, parent_tally, cand)
+        else:
+            tallies = self.ballots.tally(mask)
+
+        if isinstance(self.ballots, BallotTrie):
+            scanned = self.ballots.nnodes
+        elif parent_tally is not None:
+            scanned = len(self.ballots.rows_ranking(cand))
+        else:
+            scanned = self.ballots.nballots
+
+        with self.lock:
+            self.scanned += scanned
+
+        self.add(bits, tallies)
+
+        return tallies
+
+    def add(self, bits, tallies):
+        '''
+        Record the given vector of 'tallies' for the continuing candidates
+        in the bitmask 'bits'.
+        '''
+        with self.lock:
+            if bits in self.entries:
+                return
+
+            self.entries[bits] = tallies
+            self.nbytes += tallies.nbytes + TallyCache.ENTRY_OVERHEAD
+
+            while self.nbytes > self.max_bytes and self.entries:
+                _, old = self.entries.popitem(last=False)
+                self.nbytes -= old.nbytes + TallyCache.ENTRY_OVERHEAD
+                self.evictions += 1
+
+    def stats(self):
+        '''
+        Returns a dictionary of cache statistics.
+        '''
+        lookups = self.hits + self.misses
+
+        return {
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "derived" : self.derived,
+            "hit_rate" : self.hits/lookups if lookups else 0,
+            "evictions" : self.evictions,
+            "scanned" : self.scanned,
+            "entries" : len(self.entries),
+            "bytes" : self.nbytes,
+        }
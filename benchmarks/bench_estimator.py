@@ -0,0 +1,88 @@
+# Copyright (C) 2022 Michelle Blom
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Reports the deviation of the analytic comparison audit sample size
+estimate (analytic_sample_size) from the simulated estimate
+(simulate_sample_size), and the time taken by each, over a grid of
+contest sizes, margins and overstatement rates.
+
+Usage:
+    python benchmarks/bench_estimator.py
+    python benchmarks/bench_estimator.py -N 2000 20000 -m 0.02 0.1 \
+        -e1 0 0.002 -e2 0 0.001 -reps 100
+"""
+
+import os
+import sys
+import time
+import argparse
+import itertools
+import statistics
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sample_estimator import simulate_sample_size, analytic_sample_size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-N', dest='sizes', type=int, nargs='+', \
+        default=[2000, 20000, 200000])
+    parser.add_argument('-m', dest='margins', type=float, nargs='+', \
+        default=[0.02, 0.05, 0.1, 0.3])
+    parser.add_argument('-e1', dest='erates1', type=float, nargs='+', \
+        default=[0, 0.002, 0.01])
+    parser.add_argument('-e2', dest='erates2', type=float, nargs='+', \
+        default=[0, 0.001])
+    parser.add_argument('-r', dest='rlimit', type=float, default=0.05)
+    parser.add_argument('-seed', dest='seed', type=int, default=1234567)
+    parser.add_argument('-reps', dest='reps', type=int, default=100)
+
+    args = parser.parse_args()
+
+    np.seterr(all="ignore")
+
+    print("N,margin,e1,e2,simulated,analytic,deviation,simulated (s),"\
+        "analytic (s)")
+
+    deviations = []
+    for N,margin,e1,e2 in itertools.product(args.sizes, args.margins, \
+        args.erates1, args.erates2):
+        run = argparse.Namespace(rlimit=args.rlimit, erate1=e1, erate2=e2, \
+            reps=args.reps, seed=args.seed)
+
+        tw = int(N*(0.5 + margin/2))
+        tl = N - tw
+        mean = tw/N
+
+        start = time.perf_counter()
+        sim = simulate_sample_size(mean, tw, tl, 0, run, N)
+        sim_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        est = analytic_sample_size(mean, tw, tl, 0, run, N)
+        est_time = time.perf_counter() - start
+
+        deviation = (est - sim)/sim
+        deviations.append(abs(deviation))
+
+        print("{},{},{},{},{},{},{:+.3f},{:.3f},{:.4f}".format(N, margin, e1, \
+            e2, sim, est, deviation, sim_time, est_time))
+
+    print("Median absolute deviation {:.3f}, maximum {:.3f}".format(\
+        statistics.median(deviations), max(deviations)), file=sys.stderr)
@@ -0,0 +1,121 @@
+# Copyright (C) 2022 Michelle Blom
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Reports the memory held by the frontier of the RAIRE search, in bytes per
+frontier node. For each number of candidates, a synthetic election is
+generated (see generate.py) and searched until -node_limit nodes have been
+expanded. The memory counted is that of the frontier's nodes, their best
+ancestors, and the assertions, tails and other objects they refer to, each
+shared object counted once. Candidate identifiers, the Contest and the NEB
+assertion matrix are excluded.
+
+The package is imported from -root (by default, the checkout holding this
+script), so that the frontiers of two revisions can be compared:
+
+Usage:
+    python benchmarks/bench_memory.py -c 8 12 16
+    git worktree add /tmp/old HEAD~1
+    python benchmarks/bench_memory.py -c 8 12 16 -root /tmp/old
+"""
+
+import os
+import gc
+import sys
+import time
+import argparse
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def deep_size(roots, exclude):
+    '''
+    Returns the total size, in bytes, of the objects reachable from the
+    list of objects 'roots', counting each object once. Objects of the
+    types in 'exclude', and objects whose id is in 'exclude', are neither
+    counted nor followed.
+    '''
+    seen = set(id(x) for x in exclude if not isinstance(x, type))
+    types = tuple(x for x in exclude if isinstance(x, type))
+
+    total = 0
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, types):
+            continue
+
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', dest='cands', type=int, nargs='+', \
+        default=[8, 12, 16])
+    parser.add_argument('-b', dest='ballots', type=int, default=20000)
+    parser.add_argument('-tightness', dest='tightness', type=float, \
+        default=0.95)
+    parser.add_argument('-node_limit', dest='node_limit', type=int, \
+        default=2000)
+    parser.add_argument('-seed', dest='seed', type=int, default=1234567)
+    parser.add_argument('-root', dest='root', default=ROOT)
+
+    args = parser.parse_args()
+
+    sys.path.insert(0, args.root)
+
+    from benchmarks.generate import generate_rankings, irv_winner
+    from raire_utils import Contest, NEBAssertion
+    from ballot_store import BallotStore, TallyCache
+    from raire import initial_search_state, search_assertions
+    from sample_estimator import cp_estimate
+
+    np.seterr(all="ignore")
+
+    print("cands,ballots,expanded,frontier nodes,bytes,bytes per node,"\
+        "search (s)")
+
+    for ncands in args.cands:
+        prng = np.random.RandomState(args.seed)
+
+        cands = ["C{}".format(i) for i in range(ncands)]
+        ranks = generate_rankings(ncands, args.ballots, prng, \
+            tightness=args.tightness)
+
+        contest = Contest("1", cands, irv_winner(cands, ranks), args.ballots)
+        ballots = BallotStore(cands, ranks)
+        tally_cache = TallyCache(ballots)
+
+        start = time.perf_counter()
+
+        state = initial_search_state(contest, ballots, contest.winner, \
+            cp_estimate, False, tally_cache=tally_cache)
+        search_assertions(state, contest, ballots, cp_estimate, False, \
+            tally_cache=tally_cache, node_limit=args.node_limit)
+
+        elapsed = time.perf_counter() - start
+
+        nodes = state.frontier.nodes
+        nbytes = deep_size(nodes, [str, type, Contest, NEBAssertion])
+
+        print("{},{},{},{},{},{:.1f},{:.3f}".format(ncands, args.ballots, \
+            state.expanded, len(nodes), nbytes, nbytes/max(len(nodes), 1), \
+            elapsed))
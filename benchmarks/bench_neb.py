@@ -0,0 +1,124 @@
+# Copyright (C) 2022 Michelle Blom
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compares the time taken to form the matrix of NEB assertions for a contest
+with the original per-pair, per-ballot loop and with the single pass NEB
+engine (compute_neb_matrix), for contests of 5, 10, 20 and 40 candidates.
+
+Usage:
+    python benchmarks/bench_neb.py -b 2000
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from raire_utils import Contest, NEBAssertion, compute_neb_matrix
+from ballot_store import BallotStore
+from sample_estimator import cp_estimate
+
+
+def random_contest(ncands, nballots, seed):
+    '''
+    Returns a contest with 'ncands' candidates, and 'nballots' random
+    ballots for it in the legacy 'cvrs' representation.
+    '''
+    prng = np.random.RandomState(seed)
+
+    cands = ["C{}".format(i) for i in range(ncands)]
+    popularity = prng.dirichlet(np.ones(ncands))
+
+    cvrs = {}
+    for b in range(nballots):
+        depth = prng.randint(1, ncands+1)
+        prefs = prng.choice(ncands, size=depth, replace=False, p=popularity)
+
+        cvrs[str(b)] = {"1" : {cands[c] : i for i,c in enumerate(prefs)}}
+
+    return Contest("1", cands, cands[0], nballots), cvrs
+
+
+def legacy_neb_matrix(contest, cvrs, asn_func):
+    # The per-pair, per-ballot loop previously used in
+    # compute_raire_assertions.
+    nebs = {c : { d : None for d in contest.candidates} 
+        for c in contest.candidates} 
+
+    for c in contest.candidates:
+        for d in contest.candidates:
+            if c == d: 
+                continue
+
+            asrn = NEBAssertion(contest.name, c, d)
+            
+            tally_c = 0
+            tally_d = 0
+            for _,r in cvrs.items():
+                tally_c += asrn.is_vote_for_winner(r)
+                tally_d += asrn.is_vote_for_loser(r)
+
+            if tally_c > tally_d:
+                asrn.difficulty = asn_func(tally_c, tally_d, \
+                    contest.tot_ballots - (tally_c + tally_d), \
+                    contest.tot_ballots)
+
+                asrn.votes_for_winner = tally_c
+                asrn.votes_for_loser = tally_d
+
+                nebs[c][d] = asrn
+
+    return nebs
+
+
+def summary(nebs):
+    return {(c, d) : (a.votes_for_winner, a.votes_for_loser, a.difficulty) \
+        for c,row in nebs.items() for d,a in row.items() if a != None}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', dest='ballots', type=int, default=2000)
+    parser.add_argument('-c', dest='cands', type=int, nargs='+', \
+        default=[5, 10, 20, 40])
+    parser.add_argument('-seed', dest='seed', type=int, default=1234567)
+
+    args = parser.parse_args()
+
+    print("cands,ballots,legacy (s),engine (s),speedup")
+
+    for ncands in args.cands:
+        contest, cvrs = random_contest(ncands, args.ballots, args.seed)
+
+        start = time.perf_counter()
+        legacy = legacy_neb_matrix(contest, cvrs, cp_estimate)
+        t_legacy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ballots = BallotStore.from_cvrs(contest, cvrs)
+        engine = compute_neb_matrix(contest, ballots, cp_estimate)
+        t_engine = time.perf_counter() - start
+
+        if summary(legacy) != summary(engine):
+            print("NEB matrices differ for {} candidates".format(ncands))
+            sys.exit(1)
+
+        print("{},{},{:.4f},{:.4f},{:.1f}".format(ncands, args.ballots, \
+            t_legacy, t_engine, t_legacy/t_engine))
@@ -0,0 +1,105 @@
+# Copyright (C) 2022 Michelle Blom
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compares the time taken to load a .raire data file with the serial loader
+and with the parallel chunked loader, over a range of worker counts, and
+checks that the loaded ballots are identical.
+
+If no input file is given, a random file is written to a temporary
+directory first.
+
+Usage:
+    python benchmarks/bench_parse.py -b 1000000 -w 1 2 4 8
+    python benchmarks/bench_parse.py -i data.raire -w 1 2 4
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.generate import generate_election, write_raire
+from raire_utils import load_contests_from_raire
+
+
+def same_contests(a, b):
+    contests_a, cvrs_a = a
+    contests_b, cvrs_b = b
+
+    if [c.__dict__ for c in contests_a] != [c.__dict__ for c in contests_b]:
+        return False
+
+    if cvrs_a.ballot_names != cvrs_b.ballot_names:
+        return False
+
+    for cid,store in cvrs_a.stores.items():
+        other = cvrs_b.stores[cid]
+        for name in ("ranks", "ballot_ids", "weights"):
+            x = getattr(store, name)
+            y = getattr(other, name)
+
+            if (x is None) != (y is None) or (x is not None and \
+                not np.array_equal(x, y)):
+                return False
+
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', dest='input', default=None)
+    parser.add_argument('-b', dest='ballots', type=int, default=1000000)
+    parser.add_argument('-c', dest='cands', type=int, default=10)
+    parser.add_argument('-n', dest='contests', type=int, default=4)
+    parser.add_argument('-w', dest='workers', type=int, nargs='+', \
+        default=[1, 2, 4, 8])
+    parser.add_argument('-weighted', dest='weighted', action='store_true')
+    parser.add_argument('-seed', dest='seed', type=int, default=1234567)
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.input
+        if path is None:
+            path = os.path.join(tmp, "random.raire")
+            write_raire(path, generate_election(args.cands, args.ballots, \
+                ncontests=args.contests, seed=args.seed))
+
+        print("file MB,workers,load (s),speedup")
+
+        size = os.path.getsize(path)/2**20
+
+        base_time = None
+        base = None
+        for w in args.workers:
+            start = time.perf_counter()
+            result = load_contests_from_raire(path, weighted=args.weighted, \
+                workers=w)
+            elapsed = time.perf_counter() - start
+
+            if base is None:
+                base, base_time = result, elapsed
+            elif not same_contests(base, result):
+                print("Loaded ballots differ with {} workers".format(w))
+                sys.exit(1)
+
+            print("{:.1f},{},{:.3f},{:.2f}".format(size, w, elapsed, \
+                base_time/elapsed))
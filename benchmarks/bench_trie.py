@@ -0,0 +1,88 @@
+# Copyright (C) 2022 Michelle Blom
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compares the time taken to tally the first continuing preferences of a
+contest's ballots, for random sets of eliminated candidates, with a scan of
+each ballot (vote_for_cand over the legacy representation), the columnar
+BallotStore, and the BallotTrie prefix trie backend.
+
+Usage:
+    python benchmarks/bench_trie.py -b 20000 -q 50
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from raire_utils import vote_for_cand
+from ballot_store import BallotStore, BallotTrie
+from bench_neb import random_contest
+
+
+def time_queries(tally_fn, queries):
+    start = time.perf_counter()
+    results = [tally_fn(q) for q in queries]
+    return time.perf_counter() - start, results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', dest='ballots', type=int, default=20000)
+    parser.add_argument('-c', dest='cands', type=int, nargs='+', \
+        default=[5, 10, 20])
+    parser.add_argument('-q', dest='queries', type=int, default=50)
+    parser.add_argument('-seed', dest='seed', type=int, default=1234567)
+
+    args = parser.parse_args()
+
+    prng = np.random.RandomState(args.seed)
+
+    print("cands,ballots,signatures,trie nodes,scan (s),store (s),trie (s)")
+
+    for ncands in args.cands:
+        contest, cvrs = random_contest(ncands, args.ballots, args.seed)
+
+        ballots = [blt[contest.name] for _,blt in cvrs.items()]
+        store = BallotStore.from_ballots(contest.candidates, ballots)
+        weighted = store.collapse()
+        trie = BallotTrie(store)
+
+        queries = [prng.rand(ncands) < 0.5 for _ in range(args.queries)]
+
+        def scan(continuing):
+            eliminated = [c for i,c in enumerate(contest.candidates) \
+                if not continuing[i]]
+
+            return [sum([vote_for_cand(c, eliminated, blt) for blt in \
+                ballots]) for c in contest.candidates]
+
+        t_scan, r_scan = time_queries(scan, queries)
+        t_store, r_store = time_queries(weighted.tally, queries)
+        t_trie, r_trie = time_queries(trie.tally, queries)
+
+        for a,b,c in zip(r_scan, r_store, r_trie):
+            if list(a) != list(b) or list(a) != list(c):
+                print("Tallies differ for {} candidates".format(ncands))
+                sys.exit(1)
+
+        print("{},{},{},{},{:.4f},{:.4f},{:.4f}".format(ncands, \
+            args.ballots, weighted.nballots, trie.nnodes, t_scan, t_store, \
+            t_trie))
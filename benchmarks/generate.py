@@ -0,0 +1,194 @@
+# Copyright (C) 2022 Michelle Blom
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Seeded generator of synthetic IRV elections, written as .raire or .txt
+data files.
+
+Rankings are drawn from a Plackett-Luce model, in which candidate 'i' has
+weight exp(-3*(1 - tightness)*i/(ncands - 1)): with a tightness of 1, all
+candidates are equally popular (and margins are close); with a tightness
+of 0, the most popular candidate is e^3 times more popular than the
+least. The number of candidates ranked on each ballot is drawn from one
+of the DEPTHS distributions. The winner of each contest is found by
+tabulating the generated ballots.
+
+Usage:
+    python benchmarks/generate.py -o data.raire -c 6 -b 100000 -n 2
+    python benchmarks/generate.py -o data.txt -c 10 -b 50000 \
+        -depth geometric -tightness 0.9
+"""
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ballot_store import BallotStore, rank_dtype
+
+
+# Distributions of the number of candidates ranked on a ballot: every
+# candidate ('full'), uniform between 1 and the number of candidates
+# ('uniform'), or geometric with success probability 'depth_p', truncated
+# at the number of candidates ('geometric').
+DEPTHS = ("full", "uniform", "geometric")
+
+
+def generate_rankings(ncands, nballots, prng, depth="uniform", depth_p=0.5,\
+    tightness=0.5):
+    '''
+    Returns a rank matrix (as held by a BallotStore) of 'nballots' random
+    rankings over 'ncands' candidates, drawn using the random state 'prng'.
+    '''
+    if depth not in DEPTHS:
+        raise ValueError("Unknown depth distribution {}".format(depth))
+
+    logw = -3*(1 - tightness)*np.arange(ncands)/max(ncands - 1, 1)
+
+    # Ordering candidates by their log weight plus Gumbel noise gives a
+    # ranking drawn from the Plackett-Luce model.
+    keys = logw + prng.gumbel(size=(nballots, ncands))
+    ranks = np.argsort(-keys, axis=1)
+
+    if depth == "full":
+        depths = np.full(nballots, ncands)
+    elif depth == "uniform":
+        depths = prng.randint(1, ncands+1, size=nballots)
+    else:
+        depths = np.minimum(prng.geometric(depth_p, size=nballots), ncands)
+
+    ranks[np.arange(ncands)[None,:] >= depths[:,None]] = -1
+
+    return ranks.astype(rank_dtype(ncands))
+
+
+def irv_winner(candidates, ranks):
+    '''
+    Tabulate the ballots in the rank matrix 'ranks', returning the IRV
+    winner. Of the candidates tied for elimination, the one listed first in
+    'candidates' is eliminated (see BallotStore.tabulate_irv).
+    '''
+    order, _ = BallotStore(candidates, ranks).tabulate_irv()
+
+    return candidates[order[-1]]
+
+
+def generate_election(ncands, nballots, ncontests=1, depth="uniform", \
+    depth_p=0.5, tightness=0.5, seed=1234567):
+    '''
+    Generate 'ncontests' contests, each with 'ncands' candidates, over
+    which 'nballots' ballots are spread at random.
+
+    Output:
+        Returns a list of (name, candidates, winner, ranks) tuples, one per
+        contest, where 'ranks' is the rank matrix of its ballots.
+    '''
+    prng = np.random.RandomState(seed)
+
+    cands = ["C{}".format(i) for i in range(ncands)]
+
+    sizes = np.bincount(prng.randint(ncontests, size=nballots), \
+        minlength=ncontests)
+
+    contests = []
+    for i,size in enumerate(sizes):
+        ranks = generate_rankings(ncands, int(size), prng, depth=depth, \
+            depth_p=depth_p, tightness=tightness)
+
+        contests.append((str(i+1), cands, irv_winner(cands, ranks), ranks))
+
+    return contests
+
+
+def _preferences(candidates, ranks):
+    # Yields the list of candidate identifiers ranked on each ballot.
+    for row in ranks.tolist():
+        yield [candidates[c] for c in row if c != -1]
+
+
+def write_raire(path, contests):
+    '''
+    Write the contests given by generate_election to the .raire file
+    'path'. Ballots are numbered from 0 across all contests.
+    '''
+    with open(path, "w") as out:
+        print(len(contests), file=out)
+        for name,cands,winner,_ in contests:
+            print("1,{},{},{},winner,{}".format(name, len(cands), \
+                ",".join(cands), winner), file=out)
+
+        bid = 0
+        for name,cands,_,ranks in contests:
+            for prefs in _preferences(cands, ranks):
+                print("{},{},{}".format(name, bid, ",".join(prefs)), file=out)
+                bid += 1
+
+
+def write_txt(path, contests):
+    '''
+    Write the single contest given by generate_election to the .txt file
+    'path', with one line per distinct ranking.
+    '''
+    if len(contests) != 1:
+        raise ValueError("A .txt data file holds exactly one contest")
+
+    _,cands,winner,ranks = contests[0]
+
+    signatures, counts = np.unique(ranks, axis=0, return_counts=True)
+
+    with open(path, "w") as out:
+        print("{},winner,{}".format(",".join(cands), winner), file=out)
+        print(",".join(["P{}".format(i) for i in range(len(cands))]), \
+            file=out)
+        print("-----", file=out)
+
+        for prefs,num in zip(_preferences(cands, signatures), counts):
+            print("({}) : {}".format(",".join(prefs), num), file=out)
+
+
+def write_election(path, contests):
+    '''
+    Write the contests given by generate_election to 'path', in .txt or
+    .raire format (chosen by file extension).
+    '''
+    if path.endswith(".txt"):
+        write_txt(path, contests)
+    else:
+        write_raire(path, contests)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', dest='output', required=True)
+    parser.add_argument('-c', dest='cands', type=int, default=6)
+    parser.add_argument('-b', dest='ballots', type=int, default=100000)
+    parser.add_argument('-n', dest='contests', type=int, default=1)
+    parser.add_argument('-depth', dest='depth', choices=DEPTHS, \
+        default="uniform")
+    parser.add_argument('-depth_p', dest='depth_p', type=float, default=0.5)
+    parser.add_argument('-tightness', dest='tightness', type=float, \
+        default=0.5)
+    parser.add_argument('-seed', dest='seed', type=int, default=1234567)
+
+    args = parser.parse_args()
+
+    contests = generate_election(args.cands, args.ballots, \
+        ncontests=args.contests, depth=args.depth, depth_p=args.depth_p, \
+        tightness=args.tightness, seed=args.seed)
+
+    write_election(args.output, contests)
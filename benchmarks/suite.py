@@ -0,0 +1,233 @@
+# Copyright (C) 2022 Michelle Blom
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Timed benchmark suite. For each combination of the given numbers of
+candidates and ballots, a synthetic election is generated (see
+generate.py) and written as .raire and .txt files, and the following are
+timed on it:
+
+    load_raire           load_contests_from_raire
+    load_raire_weighted  load_contests_from_raire, weighted
+    load_txt             load_contests_from_txt
+    neb_matrix           compute_neb_matrix
+    raire                compute_raire_assertions with agap=0
+    raire_agap           compute_raire_assertions with the given -agap
+    sim_irv              sim_irv (simp_assertions.py)
+    simple_assertions    simple_IRV_assertions (simp_assertions.py)
+    sample_size          sample_size for each assertion found by RAIRE
+
+All but the loaders are run with each of the ballot engines given by
+-engines ('store' for a BallotStore, 'trie' for a BallotTrie). Results,
+with the minimum and median time over -repeat runs of each, are written
+to a JSON file so that runs on different versions can be compared.
+
+Usage:
+    python benchmarks/suite.py -o results.json
+    python benchmarks/suite.py -c 5 10 -b 10000 100000 -repeat 5 \
+        -o results.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+
+from benchmarks.generate import generate_election, write_raire, write_txt, \
+    DEPTHS
+from raire_utils import load_contests_from_raire, load_contests_from_txt, \
+    compute_neb_matrix
+from ballot_store import BallotTrie, contest_ballots
+from raire import compute_raire_assertions
+from sample_estimator import sample_size, cp_estimate
+from simp_assertions import sim_irv, simple_IRV_assertions
+
+
+# Version of the layout of the results file.
+RESULTS_VERSION = 1
+
+
+def time_call(func, repeat):
+    '''
+    Call 'func' 'repeat' times, returning the list of times taken (in
+    seconds), and the value returned by the last call.
+    '''
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+
+    return times, result
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, \
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args, tmp):
+    '''
+    Run the suite with the settings in 'args', writing generated data files
+    to the directory 'tmp'. Returns a list of results, one per benchmark and
+    dataset.
+    '''
+    results = []
+
+    def record(name, dataset, times, engine=None):
+        result = {
+            "benchmark" : name,
+            "dataset" : dataset,
+            "engine" : engine,
+            "times" : times,
+            "min" : min(times),
+            "median" : statistics.median(times),
+        }
+        results.append(result)
+
+        print("{:<20} {:>6} {:>9} {:<6} {:10.4f}s".format(name, \
+            dataset["candidates"], dataset["ballots"], engine or "", \
+            result["min"]), file=sys.stderr)
+
+    for ncands in args.cands:
+        for nballots in args.ballots:
+            dataset = {"candidates" : ncands, "ballots" : nballots, \
+                "depth" : args.depth, "tightness" : args.tightness, \
+                "seed" : args.seed}
+
+            election = generate_election(ncands, nballots, depth=args.depth,\
+                tightness=args.tightness, seed=args.seed)
+
+            raire_path = os.path.join(tmp, "{}-{}.raire".format(ncands, \
+                nballots))
+            txt_path = os.path.join(tmp, "{}-{}.txt".format(ncands, nballots))
+
+            write_raire(raire_path, election)
+            write_txt(txt_path, election)
+
+            times, _ = time_call(lambda : load_contests_from_raire(\
+                raire_path), args.repeat)
+            record("load_raire", dataset, times)
+
+            times, (contests, cvrs) = time_call(lambda : \
+                load_contests_from_raire(raire_path, weighted=True), \
+                args.repeat)
+            record("load_raire_weighted", dataset, times)
+
+            times, _ = time_call(lambda : load_contests_from_txt(txt_path, \
+                weighted=True), args.repeat)
+            record("load_txt", dataset, times)
+
+            contest = contests[0]
+            N = contest.tot_ballots
+
+            for engine in args.engines:
+                ballots = contest_ballots(contest, cvrs)
+                if engine == "trie":
+                    ballots = BallotTrie(ballots)
+
+                times, _ = time_call(lambda : compute_neb_matrix(contest, \
+                    ballots, cp_estimate), args.repeat)
+                record("neb_matrix", dataset, times, engine)
+
+                times, audit = time_call(lambda : compute_raire_assertions(\
+                    contest, ballots, contest.winner, cp_estimate, False), \
+                    args.repeat)
+                record("raire", dataset, times, engine)
+
+                times, _ = time_call(lambda : compute_raire_assertions(\
+                    contest, ballots, contest.winner, cp_estimate, False, \
+                    agap=args.agap), args.repeat)
+                record("raire_agap", dataset, times, engine)
+
+                times, (winner, runner_up) = time_call(lambda : sim_irv(\
+                    contest, ballots), args.repeat)
+                record("sim_irv", dataset, times, engine)
+
+                times, _ = time_call(lambda : simple_IRV_assertions(contest,\
+                    ballots, winner, runner_up), args.repeat)
+                record("simple_assertions", dataset, times, engine)
+
+            def sample_sizes():
+                for asrtn in audit:
+                    tother = N - asrtn.votes_for_winner - asrtn.votes_for_loser
+                    amean = (asrtn.votes_for_winner + 0.5*tother)/N
+
+                    sample_size(amean, asrtn.votes_for_winner, \
+                        asrtn.votes_for_loser, tother, args, N)
+
+            times, _ = time_call(sample_sizes, args.repeat)
+            record("sample_size", dataset, times)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', dest='output', required=True)
+    parser.add_argument('-c', dest='cands', type=int, nargs='+', \
+        default=[5, 8])
+    parser.add_argument('-b', dest='ballots', type=int, nargs='+', \
+        default=[10000, 100000])
+    parser.add_argument('-depth', dest='depth', choices=DEPTHS, \
+        default="uniform")
+    parser.add_argument('-tightness', dest='tightness', type=float, \
+        default=0.5)
+    parser.add_argument('-engines', dest='engines', nargs='+', \
+        choices=("store", "trie"), default=["store", "trie"])
+    parser.add_argument('-agap', dest='agap', type=float, default=0.05)
+    parser.add_argument('-repeat', dest='repeat', type=int, default=3)
+    parser.add_argument('-seed', dest='seed', type=int, default=1234567)
+
+    # Settings passed to sample_size.
+    parser.add_argument('-r', dest='rlimit', type=float, default=0.05)
+    parser.add_argument('-e1', dest='erate1', type=float, default=0.002)
+    parser.add_argument('-e2', dest='erate2', type=float, default=0)
+    parser.add_argument('-reps', dest='reps', type=int, default=20)
+
+    args = parser.parse_args()
+
+    np.seterr(all="ignore")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run_suite(args, tmp)
+
+    report = {
+        "version" : RESULTS_VERSION,
+        "created" : time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "revision" : git_revision(),
+        "python" : platform.python_version(),
+        "numpy" : np.__version__,
+        "platform" : platform.platform(),
+        "settings" : vars(args),
+        "results" : results,
+    }
+
+    with open(args.output, "w") as out:
+        json.dump(report, out, indent=2)
@@ -0,0 +1,212 @@
+# Copyright (C) 2022 Michelle Blom
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Binary cache of the contests and ballots in a .raire or .txt data file.
+#
+# A data file is compiled once into a cache directory (by default, the path
+# of the data file with '.cache' appended) holding a JSON description of the
+# contests, and the arrays of each contest's BallotStore saved in .npy
+# format. Later loads of the same file open these arrays as read-only
+# memory maps, rather than parsing the text again. A cache is only used
+# while it is fresh: its record of the data file's size and modification
+# time must match the file on disk.
+#
+# Usage: python contest_cache.py -i data.raire [-unweighted]
+
+from raire_utils import Contest, load_contests_from_raire, \
+    load_contests_from_txt
+from ballot_store import BallotStore, CVRStore
+
+import numpy as np
+
+import os
+import json
+import argparse
+
+
+# Version of the cache layout; caches of other versions are ignored.
+CACHE_VERSION = 1
+
+ARRAYS = ("ranks", "ballot_ids", "weights")
+
+
+def cache_dir_for(path):
+    return path + ".cache"
+
+
+def _variant(weighted):
+    # Weighted and unweighted forms of a data file are cached separately.
+    return "weighted" if weighted else "full"
+
+
+def _meta_path(cache_dir, weighted):
+    return os.path.join(cache_dir, "{}.json".format(_variant(weighted)))
+
+
+def _source_stamp(path):
+    st = os.stat(path)
+    return {"size" : st.st_size, "mtime_ns" : st.st_mtime_ns}
+
+
+def load_contests_from_file(path, weighted=False, workers=1):
+    '''
+    Parse a data file in .txt or .raire format (chosen by file extension),
+    returning the list of contests and a CVRStore holding their ballots.
+    A .raire file is parsed by 'workers' processes (see
+    load_contests_from_raire).
+    '''
+    if path.endswith(".txt"):
+        return load_contests_from_txt(path, weighted=weighted)
+
+    return load_contests_from_raire(path, weighted=weighted, workers=workers)
+
+
+def compile_contests(path, weighted=False, cache_dir=None, workers=1):
+    '''
+    Parse the data file 'path' and write its contests and ballots to a
+    binary cache.
+
+    Input:
+        path       - data file in .txt or .raire format.
+        weighted   - if True, the cache holds weighted ballot stores (see
+                     load_contests_from_raire).
+        cache_dir  - directory in which to write the cache (defaults to
+                     cache_dir_for(path)).
+        workers    - number of processes used to parse the file.
+
+    Output:
+        Returns the list of contests and CVRStore parsed from 'path'.
+    '''
+    cache_dir = cache_dir_for(path) if cache_dir is None else cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+
+    stamp = _source_stamp(path)
+
+    contests, cvrs = load_contests_from_file(path, weighted=weighted, \
+        workers=workers)
+
+    variant = _variant(weighted)
+
+    meta = {
+        "version" : CACHE_VERSION,
+        "source" : stamp,
+        "ballot_key" : "int" if cvrs.ballot_key is int else "str",
+        "ballot_names" : cvrs.ballot_names,
+        "contests" : [],
+    }
+
+    for i,contest in enumerate(contests):
+        store = cvrs.stores[contest.name]
+
+        arrays = {}
+        for name in ARRAYS:
+            arr = getattr(store, name)
+            if arr is None:
+                continue
+
+            fname = "{}-{}-{}.npy".format(variant, i, name)
+            np.save(os.path.join(cache_dir, fname), arr)
+            arrays[name] = fname
+
+        meta["contests"].append({
+            "name" : contest.name,
+            "candidates" : contest.candidates,
+            "winner" : contest.winner,
+            "tot_ballots" : contest.tot_ballots,
+            "order" : contest.outcome,
+            "arrays" : arrays,
+        })
+
+    # The description is written last, so that an interrupted compile does
+    # not leave a cache that appears complete.
+    meta_path = _meta_path(cache_dir, weighted)
+    with open(meta_path + ".tmp", "w") as out:
+        json.dump(meta, out)
+
+    os.replace(meta_path + ".tmp", meta_path)
+
+    return contests, cvrs
+
+
+def load_cached_contests(path, weighted=False, cache_dir=None):
+    '''
+    Returns the list of contests and CVRStore for the data file 'path' from
+    its binary cache, with ballot arrays opened as read-only memory maps.
+    Returns None if there is no cache for 'path', or the cache is stale.
+    '''
+    cache_dir = cache_dir_for(path) if cache_dir is None else cache_dir
+
+    try:
+        with open(_meta_path(cache_dir, weighted), "r") as data:
+            meta = json.load(data)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get("version") != CACHE_VERSION or \
+        meta.get("source") != _source_stamp(path):
+        return None
+
+    contests = []
+    stores = {}
+
+    for info in meta["contests"]:
+        arrays = {name : np.load(os.path.join(cache_dir, fname), \
+            mmap_mode='r') for name,fname in info["arrays"].items()}
+
+        contests.append(Contest(info["name"], info["candidates"], \
+            info["winner"], info["tot_ballots"], order=info["order"]))
+
+        stores[info["name"]] = BallotStore(info["candidates"], \
+            arrays["ranks"], ballot_ids=arrays.get("ballot_ids"), \
+            weights=arrays.get("weights"))
+
+    cvrs = CVRStore(stores, ballot_names=meta["ballot_names"], \
+        ballot_key=int if meta["ballot_key"] == "int" else str)
+
+    return contests, cvrs
+
+
+def load_contests(path, weighted=False, use_cache=True, workers=1):
+    '''
+    Load the contests and ballots of the data file 'path', from its binary
+    cache if a fresh one exists (and 'use_cache' is True), and otherwise by
+    parsing the file with 'workers' processes.
+    '''
+    if use_cache:
+        cached = load_cached_contests(path, weighted=weighted)
+        if cached is not None:
+            return cached
+
+    return load_contests_from_file(path, weighted=weighted, workers=workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', dest='input', required=True)
+
+    # run_raire.py and simp_assertions.py load weighted ballot stores; the
+    # unweighted form keeps ballot ids.
+    parser.add_argument('-unweighted', dest='unweighted', action='store_true')
+
+    # Number of processes over which to parse the file.
+    parser.add_argument('-j', dest='jobs', type=int, default=1)
+
+    args = parser.parse_args()
+
+    contests, _ = compile_contests(args.input, weighted=not args.unweighted, \
+        workers=args.jobs)
+
+    print("Compiled {} contests from {} to {}".format(len(contests), 
+        args.input, cache_dir_for(args.input)))
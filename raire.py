@@ -15,97 +15,188 @@
 
 
 from raire_utils import NENAssertion, NEBAssertion, RaireAssertion, \
-    RaireFrontier, RaireNode, find_best_audit, perform_dive, manage_node, Contest
+    RaireFrontier, RaireNode, find_best_audit, perform_dive, dive_bound, \
+    manage_node, compute_neb_matrix, evaluate_nodes, Contest
+from ballot_store import BallotTrie, TallyCache, contest_ballots
 
 import numpy as np
+import os
 import sys
+import gzip
+import time
+import pickle
+import hashlib
 
 
-def compute_raire_assertions(
-    contest, cvrs, winner, asn_func, log, stream=sys.stdout, agap=0,\
-    seed=123456
-):
+# Version of the layout of checkpoint files; checkpoints of other versions
+# are ignored.
+CHECKPOINT_VERSION = 4
 
+
+class SearchState:
+    """
+    State of a search for assertions, from which the search can be resumed:
+    the matrix of NEB assertions for the contest, the frontier (whose nodes
+    hold their best ancestors and explored candidates), the lower bound on
+    audit difficulty, the number of nodes expanded, and the time spent
+    searching (in seconds). 'digest' identifies the inputs to the search
+    (see search_digest and audit_state_digest).
     """
 
-    Inputs:
-        contest        - the contest being audited (Contest structure)
+    def __init__(self, nebs, frontier, lowerbound):
+        self.nebs = nebs
+        self.frontier = frontier
+        self.lowerbound = lowerbound
+        self.expanded = 0
+        self.elapsed = 0
+        self.digest = None
 
-        cvrs           - mapping of ballot_id to votes:
-                {
-                    'ballot_id': {
-                        'contest': {
-                            'candidate1': 1,
-                            'candidate2': 0,
-                            'candidate3': 2,
-                            'candidate4': 3,
-                            ...
-                        }
-                    ...
-                }
+        # The pair (first, above) of tallies from which the NEB assertions
+        # were formed (see BallotStore.neb_tallies), and, once the search
+        # is over, the entries of its TallyCache. These are kept so that
+        # the search can be updated when ballots are added (see
+        # update_raire_assertions).
+        self.neb_tallies = None
+        self.tallies = None
+
+
+def search_digest(contest, ballots, winner, asn_func):
+    '''
+    Returns a hash of the inputs to a search for assertions: the contest,
+    its ballots (a BallotStore or BallotTrie), the reported winner and the
+    difficulty estimator.
+    '''
+    h = hashlib.sha256()
+
+    h.update(repr((contest.name, contest.candidates, contest.tot_ballots, \
+        contest.outcome, winner, getattr(asn_func, "__qualname__", \
+        repr(asn_func)))).encode("utf-8"))
 
-        winner         - reported winner of the contest
+    h.update(ballots.digest().encode("utf-8"))
 
-        asn_func       - function that takes three values as input: tally for 
-                         the winner of an assertion; the loser; and the total 
-                         number of auditable ballots. Returns an estimate of 
-                         how difficult a RAIRE assertion with that margin will
-                         be to audit.
+    return h.hexdigest()
 
-        log            - flag indicating if logging statements should
-                         be printed during the algorithm.
 
-        stream         - stream to which logging statements should
-                         be printed.
-        
-        agap           - allowed gap between the lower and upper bound
-                         on expected audit difficulty. Once these bounds
-                         converge (to within 'agap') algorithm can stop
-                         and return  audit configuration found. Generally,
-                         keep this at 0 unless the algorithm is not 
-                         terminating in a reasonable time. Then set it to
-                         as small a value as possible, and increase, until
-                         the algorithm terminates. For some instances, the
-                         difference between the lower and upper bound on 
-                         expected audit difficulty gets to a point where it
-                         is quite small, but doesn't converge. 
+def audit_state_digest(contest, winner, asn_func):
+    '''
+    Returns a hash of the inputs to a search for assertions that do not
+    change as ballots are added to a contest: its name and candidates, the
+    reported winner and the difficulty estimator.
+    '''
+    return hashlib.sha256(repr((contest.name, contest.candidates, winner, \
+        getattr(asn_func, "__qualname__", repr(asn_func)))).encode(\
+        "utf-8")).hexdigest()
+
+
+class _CheckpointPickler(pickle.Pickler):
+    # Assertions refer to the Contest being audited, which compares by
+    # identity (see RaireAssertion.same_as), so it is saved by reference and
+    # restored as the contest of the resumed search.
+    def __init__(self, out, contest):
+        super().__init__(out, protocol=pickle.HIGHEST_PROTOCOL)
+        self.contest = contest
+
+    def persistent_id(self, obj):
+        return "contest" if obj is self.contest else None
+
+
+class _CheckpointUnpickler(pickle.Unpickler):
+    def __init__(self, data, contest):
+        super().__init__(data)
+        self.contest = contest
+
+    def persistent_load(self, pid):
+        if pid != "contest":
+            raise pickle.UnpicklingError("Unknown reference {}".format(pid))
+
+        return self.contest
+
+
+def save_checkpoint(path, state, contest):
+    '''
+    Save the SearchState 'state' of the search for assertions for 'contest'
+    to the checkpoint file 'path'. The file is replaced atomically, so an
+    interrupted save leaves the previous checkpoint intact.
+    '''
+    with gzip.open(path + ".tmp", "wb", compresslevel=1) as out:
+        _CheckpointPickler(out, contest).dump((CHECKPOINT_VERSION, \
+            state.digest, state))
+
+    os.replace(path + ".tmp", path)
+
+
+def load_checkpoint(path, digest, contest):
+    '''
+    Returns the SearchState for 'contest' saved in the checkpoint file
+    'path', or None if there is no such file (or it is of another version).
+    Raises a ValueError if the checkpoint was saved for inputs other than
+    those with the given 'digest' (see search_digest).
+    '''
+    if not os.path.exists(path):
+        return None
+
+    with gzip.open(path, "rb") as data:
+        version, saved, state = _CheckpointUnpickler(data, contest).load()
+
+    if version != CHECKPOINT_VERSION:
+        return None
+
+    if saved != digest:
+        raise ValueError("Checkpoint {} was saved for different contest "\
+            "data".format(path))
+
+    return state
+
+
+def save_audit_state(path, state, contest, winner, asn_func, tally_cache, \
+    audit_not_possible=False):
+    '''
+    Save the SearchState 'state' of a finished search for assertions for
+    'contest', along with the tallies held in 'tally_cache', to the file
+    'path' (see update_raire_assertions).
 
-    Outputs:
-        A list of RaireAssertions to be audited. If this collection of
-        assertions is found to hold, then all alternate outcomes, in which
-        an alternate candidate to 'winner' wins, can be ruled out. 
-    """
+    A search that finds an audit is not possible stops part way through
+    the expansion of a node, leaving a frontier that does not cover all
+    alternate outcomes. Such a state is not saved, and any existing file
+    at 'path' is removed, so that the next update starts a new search.
+    '''
+    if audit_not_possible:
+        if os.path.exists(path):
+            os.remove(path)
+        return
 
-    ncands = len(contest.candidates)
-    
-    # First look at all of the NEB assertions that could be formed for
-    # this contest. We will refer to this matrix when examining the best
-    # way to prune branches of the "alternate outcome space". 
-    nebs = {c : { d : None for d in contest.candidates} 
-        for c in contest.candidates} 
+    with tally_cache.lock:
+        state.tallies = dict(tally_cache.entries)
+
+    state.digest = audit_state_digest(contest, winner, asn_func)
+
+    save_checkpoint(path, state, contest)
 
-    for c in contest.candidates:
-        for d in contest.candidates:
-            if c == d: 
-                continue
 
-            asrn = NEBAssertion(contest.name, c, d)
-            
-            tally_c = 0
-            tally_d = 0
-            for _,r in cvrs.items():
-                tally_c += asrn.is_vote_for_winner(r)
-                tally_d += asrn.is_vote_for_loser(r)
+def initial_search_state(contest, ballots, winner, asn_func, log, \
+    stream=sys.stdout, tally_cache=None, stats=None):
+    '''
+    Returns the SearchState at the start of a search for assertions to
+    rule out all outcomes in which a candidate other than 'winner' wins,
+    holding the matrix of NEB assertions for the contest and the initial
+    frontier (see compute_raire_assertions for the inputs).
+    '''
+    ncands = len(contest.candidates)
+
+    if tally_cache is None:
+        tally_cache = TallyCache(ballots)
 
-            if tally_c > tally_d:
-                asrn.difficulty = asn_func(tally_c, tally_d, \
-                    contest.tot_ballots - (tally_c + tally_d), \
-                    contest.tot_ballots)
+    phase_start = time.perf_counter()
 
-                asrn.votes_for_winner = tally_c
-                asrn.votes_for_loser = tally_d
+    # First look at all of the NEB assertions that could be formed for
+    # this contest. We will refer to this matrix when examining the best
+    # way to prune branches of the "alternate outcome space". 
+    neb_tallies = ballots.neb_tallies()
+    nebs = compute_neb_matrix(contest, ballots, asn_func, tallies=neb_tallies)
 
-                nebs[c][d] = asrn
+    if stats != None:
+        stats.times["neb"] = time.perf_counter() - phase_start
+        phase_start = time.perf_counter()
 
 
     # The RAIRE algorithm progressively searches through the space of 
@@ -116,9 +207,6 @@ def compute_raire_assertions(
     # winner. All candidates not mentioned in this tail are assumed to have
     # already been eliminated. 
 
-    ballots = [blt[contest.name] for _,blt in cvrs.items() 
-        if contest.name in blt]
-
     # This is a running lowerbound on the overall difficulty of the 
     # election audit. 
     lowerbound = -10
@@ -134,10 +222,15 @@ def compute_raire_assertions(
         for d in contest.candidates:
             if c == d: continue
 
-            newn = RaireNode([d,c])
+            newn = RaireNode((d,c), contest.bitmask((d,c)))
             newn.expandable = True if ncands > 2 else False
 
-            find_best_audit(contest, ballots, nebs, newn, asn_func)
+            find_best_audit(contest, ballots, nebs, newn, asn_func, \
+                tally_cache=tally_cache)
+
+            if stats != None:
+                stats.nodes_created += 1
+                stats.find_best_audit += 1
 
             if log:
                 print("TESTED ", file=stream, end='')
@@ -148,33 +241,300 @@ def compute_raire_assertions(
 
             frontier.insert_node(newn)
 
-    # Flag to keep track of whether a full manual recount will be required
-    audit_not_possible = False
-
     if log:
         print("===============================================", file=stream)
         print("Initial Frontier", file=stream)
         frontier.display(stream=stream)
         print("===============================================", file=stream)
-    
+
+    if stats != None:
+        stats.times["search"] += time.perf_counter() - phase_start
+
+    state = SearchState(nebs, frontier, lowerbound)
+    state.neb_tallies = neb_tallies
+
+    return state
+
+
+def update_search_state(state, contest, ballots, batch, asn_func, log, \
+    stream=sys.stdout, tally_cache=None, stats=None):
+    '''
+    Returns the SearchState from which to continue a finished search for
+    assertions (the SearchState 'state', as saved by save_audit_state) once
+    the ballots in 'batch' are added to the contest. 'ballots' holds all
+    ballots for the contest, including those in 'batch' (see
+    update_raire_assertions for the other inputs).
+
+    The NEB tallies, and the tallies cached by the previous search, are
+    brought up to date by tallying 'batch' alone. Each node on the
+    frontier, and each of its ancestors, is then given the best assertion
+    under the updated tallies, and a new lower bound on audit difficulty
+    is found by diving (see dive_bound). A node no more difficult than
+    this bound is closed, or replaced by its best ancestor if that is no
+    more difficult than the bound; the branch below every other node is
+    re-opened, with the node made expandable again. The search continued
+    from this state finds an audit as difficult as a new search would.
+
+    Returns a pair: the updated SearchState, and a boolean indicating
+    whether an audit has been found to be not possible.
+    '''
+    if tally_cache is None:
+        tally_cache = TallyCache(ballots)
+
+    ncands = len(contest.candidates)
+
+    phase_start = time.perf_counter()
+
+    first, above = state.neb_tallies
+    batch_first, batch_above = batch.neb_tallies()
+
+    neb_tallies = (first + batch_first, above + batch_above)
+    nebs = compute_neb_matrix(contest, ballots, asn_func, tallies=neb_tallies)
+
+    # Tallies cached by the previous search are updated with those of the
+    # batch, rather than recounted over all ballots. The batch rows (or trie
+    # nodes) scanned to do so are counted as scanned by the cache.
+    batch_rows = batch.nnodes if isinstance(batch, BallotTrie) else \
+        batch.nballots
+
+    for bits, tallies in state.tallies.items():
+        tally_cache.add(bits, tallies + batch.tally(batch.bits_to_mask(bits)))
+
+    with tally_cache.lock:
+        tally_cache.scanned += batch_rows*len(state.tallies)
+
+    if stats != None:
+        stats.times["neb"] = time.perf_counter() - phase_start
+        phase_start = time.perf_counter()
+
+    nodes = state.frontier.nodes
+
+    # Ancestors of the nodes on the frontier (the nodes whose tails are
+    # suffixes of theirs), by tail. A node's best ancestor was the least
+    # difficult of its ancestors under the previous tallies, and may no
+    # longer be, so every ancestor is rescored and best ancestors are
+    # assigned anew. Ancestors that are no longer referred to by a best
+    # ancestor chain are recreated as needed.
+    ancestors = {}
+    for node in nodes:
+        ancestor = node.best_ancestor
+        while ancestor != None:
+            ancestors.setdefault(ancestor.tail, ancestor)
+            ancestor = ancestor.best_ancestor
+
+    rescored = set()
+    for node in nodes:
+        parent = None
+        for k in range(2, len(node.tail) + 1):
+            tail = node.tail[-k:]
+
+            current = node if k == len(node.tail) else ancestors.get(tail)
+            if current is None:
+                current = RaireNode(tail, parent.bits | 1 << \
+                    contest.index[tail[0]])
+                current.expandable = False
+                ancestors[tail] = current
+
+            if not id(current) in rescored:
+                rescored.add(id(current))
+
+                parent_tally = None if parent is None else \
+                    tally_cache.tally(parent.bits)
+
+                current.estimate = np.inf
+                find_best_audit(contest, ballots, nebs, current, asn_func, \
+                    tally_cache=tally_cache, parent_tally=parent_tally)
+
+                if stats != None:
+                    stats.find_best_audit += 1
+
+            current.best_ancestor = None if parent is None else \
+                parent.best_ancestor if parent.best_ancestor != None and \
+                parent.best_ancestor.estimate <= parent.estimate else parent
+
+            parent = current
+
+    # The lower bound found by the previous search was formed from tallies
+    # that have since changed. A new one is formed, as the search would,
+    # by diving from each node with a tail of size two, and from the
+    # leaves of the frontier that are complete outcomes.
+    lowerbound = -10
+
+    top = [n for n in list(ancestors.values()) + nodes if len(n.tail) == 2]
+    for node in top:
+        bound = dive_bound(node, contest, ballots, nebs, asn_func, \
+            tally_cache=tally_cache, stats=stats)
+
+        lowerbound = max(lowerbound, bound)
+
+    for node in nodes:
+        if len(node.tail) == ncands:
+            bound = node.estimate
+            if node.best_ancestor != None:
+                bound = min(bound, node.best_ancestor.estimate)
+
+            lowerbound = max(lowerbound, bound)
+
+    if lowerbound == np.inf:
+        if log:
+            print("Found branch that cannot be pruned.", file=stream)
+
+        return SearchState(nebs, RaireFrontier(), np.inf), True
+
+    if log:
+        print("Updated lower bound {}".format(lowerbound), file=stream)
+
+    # Each node is then treated as the search treats the nodes it takes
+    # from the frontier: a node is closed (or replaced by its best
+    # ancestor) if it is no more difficult than the lower bound, and
+    # otherwise the branch below it is re-opened.
+    frontier = RaireFrontier()
+    replacing = []
+
+    for node in nodes:
+        ancestor = node.best_ancestor
+
+        if len(node.tail) == ncands:
+            node.expandable = False
+
+            if ancestor != None and ancestor.estimate <= node.estimate:
+                replacing.append(ancestor)
+            else:
+                frontier.insert_node(node)
+
+        elif ancestor != None and ancestor.estimate <= lowerbound:
+            replacing.append(ancestor)
+
+        elif node.estimate <= lowerbound:
+            node.expandable = False
+            frontier.insert_node(node)
+
+        else:
+            if log:
+                print("Re-opening ", file=stream, end='')
+                node.display(stream=stream)
+
+            node.expandable = True
+            node.explored = ()
+            node.explored_bits = 0
+            node.dive_node = False
+
+            frontier.insert_node(node)
+
+    # Replacing ancestors are closed from the top down; an ancestor below
+    # one that has already replaced its descendents is not needed.
+    replaced = []
+    unique = {id(n) : n for n in replacing}.values()
+    for ancestor in sorted(unique, key=lambda n: len(n.tail)):
+        if any([ancestor.is_descendent_of(r) for r in replaced]):
+            continue
+
+        ancestor.expandable = False
+        frontier.replace_descendents(ancestor, log, stream=stream)
+        replaced.append(ancestor)
+
+    if log:
+        print("===============================================", file=stream)
+        print("Updated Frontier", file=stream)
+        frontier.display(stream=stream)
+        print("===============================================", file=stream)
+
+    if stats != None:
+        stats.times["search"] += time.perf_counter() - phase_start
+
+    updated = SearchState(nebs, frontier, lowerbound)
+    updated.neb_tallies = neb_tallies
+
+    return updated, False
+
+
+def search_assertions(state, contest, ballots, asn_func, log, \
+    stream=sys.stdout, agap=0, tally_cache=None, executor=None, stats=None,\
+    time_limit=None, node_limit=None, agap_schedule=None, checkpoint=None, \
+    checkpoint_interval=300):
+    '''
+    Continue the search for assertions from the given SearchState, until
+    the frontier can no longer be improved, the bounds on audit difficulty
+    converge to within the allowed gap, or the budget is spent (see
+    compute_raire_assertions for the inputs). The search state is updated
+    in place and, if a 'checkpoint' path is given, saved to that path every
+    'checkpoint_interval' seconds.
+
+    Returns a pair: a boolean indicating whether an audit has been found
+    to be not possible, and the reason the search stopped (see SearchStats).
+    '''
+    if tally_cache is None:
+        tally_cache = TallyCache(ballots)
+
+    ncands = len(contest.candidates)
+
+    nebs = state.nebs
+    frontier = state.frontier
+    lowerbound = state.lowerbound
+    expanded = state.expanded
+
+    # Time budgets include the time spent before the search was resumed.
+    start = time.perf_counter() - state.elapsed
+    saved = time.perf_counter()
+
+    # Flag to keep track of whether a full manual recount will be required
+    audit_not_possible = False
+
+    # Reason for which the search stopped.
+    stop_reason = "complete"
 
     # -------------------- Find Assertions -----------------------------------
     while not audit_not_possible:
+        elapsed = time.perf_counter() - start
+
+        # The state of the search is consistent between iterations, and can
+        # be saved.
+        if checkpoint != None and time.perf_counter() - saved >= \
+            checkpoint_interval:
+
+            state.lowerbound = lowerbound
+            state.expanded = expanded
+            state.elapsed = elapsed
+
+            save_checkpoint(checkpoint, state, contest)
+            saved = time.perf_counter()
+
         # Check whether we can stop searching for assertions.
-        max_on_frontier = max([node.estimate for node in frontier.nodes])
+        max_on_frontier = frontier.max_estimate()
+
+        if stats != None:
+            stats.sample(frontier, lowerbound, max_on_frontier)
+
+        gap = agap
+        if agap_schedule != None:
+            gap = max([agap] + [g for t,g in agap_schedule if elapsed >= t])
 
-        if agap > 0 and lowerbound > 0 and max_on_frontier-lowerbound <= agap:
+        if gap > 0 and lowerbound > 0 and max_on_frontier-lowerbound <= gap:
             # We can rule out all branches of the tree with assertions that
             # have a difficulty that is <= lowerbound. 
+            stop_reason = "agap"
             break
 
-        to_expand = frontier.nodes[0]
+        to_expand = frontier.front()
 
         # We can also stop searching if all nodes on our frontier are leaves.
         if not to_expand.expandable:
             break
 
-        frontier.nodes.pop(0)
+        # Once the budget is spent, stop as soon as every node on the
+        # frontier can be ruled out (and so the audit is valid).
+        if max_on_frontier < np.inf and ((time_limit != None and \
+            elapsed >= time_limit) or (node_limit != None and \
+            expanded >= node_limit)):
+
+            if log:
+                print("Budget spent: lower bound {}, max on frontier {}"\
+                    .format(lowerbound, max_on_frontier), file=stream)
+
+            stop_reason = "budget"
+            break
+
+        frontier.pop_front()
 
         if to_expand.best_ancestor != None and \
             to_expand.best_ancestor.estimate <= lowerbound:
@@ -186,6 +546,9 @@ def compute_raire_assertions(
         if to_expand.estimate <= lowerbound:
             to_expand.expandable = False
             frontier.insert_node(to_expand)
+
+            if stats != None:
+                stats.nodes_closed += 1
             continue
 
         #--------------------------------------------------------------------
@@ -196,7 +559,8 @@ def compute_raire_assertions(
         # to rule out all branches. 
         if not to_expand.dive_node:
             dive_lb = perform_dive(to_expand, contest, ballots, nebs, \
-                asn_func, lowerbound, frontier, log, stream=stream)
+                asn_func, lowerbound, frontier, log, stream=stream, \
+                tally_cache=tally_cache, stats=stats)
 
             if dive_lb == np.inf:
                 # The particular branch we dived along cannot be ruled out
@@ -226,6 +590,9 @@ def compute_raire_assertions(
             if to_expand.estimate <= lowerbound:
                 to_expand.expandable = False
                 frontier.insert_node(to_expand)
+
+                if stats != None:
+                    stats.nodes_closed += 1
                 continue
 
         #--------------------------------------------------------------------
@@ -236,10 +603,16 @@ def compute_raire_assertions(
 
         # Find children of current node, and find the best assertions that 
         # could be used to prune those nodes from the tree of alternate
-        # outcomes.
-        for c in contest.candidates:
-            if not c in to_expand.tail and not c in to_expand.explored:
-                newn = RaireNode([c] + to_expand.tail)
+        # outcomes. Each child restores one eliminated candidate, so its
+        # tallies are derived from those of the current node.
+        parent_tally = tally_cache.tally(to_expand.bits)
+
+        children = []
+        used = to_expand.bits | to_expand.explored_bits
+        for i,c in enumerate(contest.candidates):
+            bit = 1 << i
+            if not used & bit:
+                newn = RaireNode((c,) + to_expand.tail, to_expand.bits | bit)
                 newn.expandable = False if len(newn.tail) == ncands else True
 
                 # Assign a 'best ancestor' to the new node. 
@@ -248,25 +621,241 @@ def compute_raire_assertions(
                     to_expand.best_ancestor.estimate <= to_expand.estimate \
                     else to_expand
 
-                find_best_audit(contest, ballots, nebs, newn, asn_func)
+                children.append(newn)
 
-                if log:
-                    print("TESTED ", file=stream, end='')
-                    newn.display(stream=stream)
+        expanded += 1
 
-                audit_not_possible, lowerbound, _ = manage_node(newn,frontier,\
-                    lowerbound, log, stream=stream)
+        if stats != None:
+            stats.nodes_expanded += 1
+            stats.nodes_created += len(children)
+            stats.find_best_audit += len(children)
+
+        # Children are evaluated independently (concurrently, if an executor
+        # is given), and then added to the frontier in candidate order.
+        for newn in evaluate_nodes(children, contest, ballots, nebs, \
+            asn_func, tally_cache=tally_cache, parent_tally=parent_tally, \
+            executor=executor):
+
+            if log:
+                print("TESTED ", file=stream, end='')
+                newn.display(stream=stream)
 
+            audit_not_possible, lowerbound, _ = manage_node(newn,frontier,\
+                lowerbound, log, stream=stream)
 
             if audit_not_possible: break    
 
         
         if log:
             print("Size of frontier {}, current lower bound {}".format(
-                len(frontier.nodes), lowerbound))
+                len(frontier), lowerbound))
 
         if audit_not_possible: break 
 
+    state.lowerbound = lowerbound
+    state.expanded = expanded
+    state.elapsed = time.perf_counter() - start
+
+    return audit_not_possible, stop_reason
+
+
+def compute_raire_assertions(
+    contest, cvrs, winner, asn_func, log, stream=sys.stdout, agap=0,\
+    seed=123456, tally_cache=None, executor=None, stats=None, \
+    time_limit=None, node_limit=None, agap_schedule=None, checkpoint=None, \
+    checkpoint_interval=300, state_file=None
+):
+
+    """
+
+    Inputs:
+        contest        - the contest being audited (Contest structure)
+
+        cvrs           - mapping of ballot_id to votes:
+                {
+                    'ballot_id': {
+                        'contest': {
+                            'candidate1': 1,
+                            'candidate2': 0,
+                            'candidate3': 2,
+                            'candidate4': 3,
+                            ...
+                        }
+                    ...
+                }
+
+                         or the ballots of the contest in columnar form, as
+                         a BallotStore or a CVRStore (see ballot_store.py).
+
+        winner         - reported winner of the contest
+
+        asn_func       - function that takes three values as input: tally for 
+                         the winner of an assertion; the loser; and the total 
+                         number of auditable ballots. Returns an estimate of 
+                         how difficult a RAIRE assertion with that margin will
+                         be to audit.
+
+        log            - flag indicating if logging statements should
+                         be printed during the algorithm.
+
+        stream         - stream to which logging statements should
+                         be printed.
+        
+        agap           - allowed gap between the lower and upper bound
+                         on expected audit difficulty. Once these bounds
+                         converge (to within 'agap') algorithm can stop
+                         and return  audit configuration found. Generally,
+                         keep this at 0 unless the algorithm is not 
+                         terminating in a reasonable time. Then set it to
+                         as small a value as possible, and increase, until
+                         the algorithm terminates. For some instances, the
+                         difference between the lower and upper bound on 
+                         expected audit difficulty gets to a point where it
+                         is quite small, but doesn't converge. Rather than
+                         tuning 'agap' by hand, a budget ('time_limit' or
+                         'node_limit') or 'agap_schedule' may be given.
+
+        tally_cache    - TallyCache over the contest's BallotStore, used to
+                         memoize candidate tallies for each set of continuing
+                         candidates met in the search. If not given, a cache
+                         with the default memory cap is used.
+
+        executor       - concurrent.futures.ThreadPoolExecutor on which the
+                         children of each expanded node are evaluated
+                         concurrently (see evaluate_nodes; a process pool
+                         cannot be used). Results are applied to the
+                         frontier in the same order as without an executor,
+                         so the audit found is unchanged.
+
+        stats          - SearchStats in which to record counters, phase
+                         timers and the trajectory of the search (see
+                         raire_utils.py). The audit found is unchanged.
+                         On return, stats.stop_reason, stats.lower_bound,
+                         stats.max_estimate and stats.gap describe how the
+                         search ended.
+
+        time_limit     - budget, in seconds, for the search (including any
+                         time spent before it was resumed). Once it is
+                         spent, the search stops as soon as every node on
+                         the frontier has an assertion that rules it out,
+                         and returns the audit formed from the frontier.
+                         This audit is valid, but its difficulty may be up
+                         to stats.gap more than that of the best audit.
+
+        node_limit     - budget on the number of nodes expanded, used as
+                         for 'time_limit'.
+
+        agap_schedule  - list of (seconds, gap) pairs: once 'seconds' have
+                         passed since the start of the search, the allowed
+                         gap is widened to at least 'gap' (see 'agap').
+
+        checkpoint     - path of a checkpoint file to which the state of
+                         the search is saved every 'checkpoint_interval'
+                         seconds. If the file exists when the search
+                         starts, the search is resumed from it, giving the
+                         same audit as an uninterrupted search. A
+                         checkpoint can only be resumed with the contest
+                         data, winner and 'asn_func' it was saved for (a
+                         ValueError is raised otherwise). It is removed
+                         once the search is over.
+
+        checkpoint_interval - seconds between checkpoints.
+
+        state_file     - path of a file to which the state of the search
+                         is saved once it is over, along with the tallies
+                         it computed, so that the audit can be updated
+                         when new ballots are added to the contest (see
+                         update_raire_assertions).
+
+    Outputs:
+        A list of RaireAssertions to be audited. If this collection of
+        assertions is found to hold, then all alternate outcomes, in which
+        an alternate candidate to 'winner' wins, can be ruled out. 
+    """
+
+    ballots = contest_ballots(contest, cvrs)
+
+    # Nodes of the search carry the bitmask of their candidates (see
+    # RaireNode.bits), which is used to key tallies of 'ballots'. Both must
+    # intern candidates in the same order.
+    if list(ballots.candidates) != list(contest.candidates):
+        raise ValueError("Ballots for contest {} list different candidates"\
+            .format(contest.name))
+
+    if tally_cache is None:
+        tally_cache = TallyCache(ballots)
+
+    scanned = tally_cache.scanned
+
+    # Resume from the checkpoint, if there is one; otherwise, start a new
+    # search.
+    state = None
+    if checkpoint != None:
+        digest = search_digest(contest, ballots, winner, asn_func)
+        state = load_checkpoint(checkpoint, digest, contest)
+
+        if log and state != None:
+            print("Resuming from checkpoint {}".format(checkpoint), \
+                file=stream)
+
+    if state is None:
+        state = initial_search_state(contest, ballots, winner, asn_func, \
+            log, stream=stream, tally_cache=tally_cache, stats=stats)
+
+        if checkpoint != None:
+            state.digest = digest
+
+    phase_start = time.perf_counter()
+
+    audit_not_possible, stop_reason = search_assertions(state, contest, \
+        ballots, asn_func, log, stream=stream, agap=agap, \
+        tally_cache=tally_cache, executor=executor, stats=stats, \
+        time_limit=time_limit, node_limit=node_limit, \
+        agap_schedule=agap_schedule, checkpoint=checkpoint, \
+        checkpoint_interval=checkpoint_interval)
+
+    if stats != None:
+        stats.times["search"] += time.perf_counter() - phase_start
+
+    # The search is over, so its checkpoint is no longer needed.
+    if checkpoint != None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    if state_file != None:
+        save_audit_state(state_file, state, contest, winner, asn_func, \
+            tally_cache, audit_not_possible)
+
+    return finish_search(state, audit_not_possible, stop_reason, log, \
+        stream=stream, stats=stats, tally_cache=tally_cache, scanned=scanned)
+
+
+def finish_search(state, audit_not_possible, stop_reason, log, \
+    stream=sys.stdout, stats=None, tally_cache=None, scanned=0):
+    '''
+    Form the audit from the frontier of a finished search (see
+    search_assertions for 'audit_not_possible' and 'stop_reason'), and
+    record how the search ended in 'stats'. 'scanned' is the value of
+    tally_cache.scanned before the search began.
+
+    Returns a list of RaireAssertions, empty if an audit is not possible.
+    '''
+    frontier = state.frontier
+    lowerbound = state.lowerbound
+
+    if stats != None:
+        stats.nodes_pruned = frontier.removed
+        if tally_cache != None:
+            stats.ballots_scanned = tally_cache.scanned - scanned
+
+        stats.sample(frontier, lowerbound, frontier.max_estimate(), \
+            force=True)
+
+        stats.stop_reason = "not possible" if audit_not_possible else \
+            stop_reason
+        stats.lower_bound = lowerbound
+        stats.max_estimate = frontier.max_estimate()
+        stats.gap = stats.max_estimate - lowerbound
+
     # If a full recount is required, return empty list.
     if audit_not_possible: 
         if log:
@@ -277,45 +866,33 @@ def compute_raire_assertions(
     # ------------------------------------------------------------------------
     # Some assertions will be used to rule out multiple branches of our
     # alternate outcome tree. Form a list of all these assertions, without
-    # duplicates.
-    assertions = []
+    # duplicates, in order of first appearance on the frontier.
+    phase_start = time.perf_counter()
+
+    assertions = {}
 
     for node in frontier.nodes:
-        skip = False
-        for assrtn in assertions:
-            if node.best_assertion.same_as(assrtn):
-                assrtn.rules_out.update(node.best_assertion.rules_out)
-                skip = True
-                break
+        key = node.best_assertion.key()
+
+        assrtn = assertions.get(key)
+        if assrtn is None:
+            assertions[key] = node.best_assertion
+        else:
+            assrtn.rules_out.update(node.best_assertion.rules_out)
 
-        if not skip:
-            assertions.append(node.best_assertion)
+    if stats != None:
+        stats.times["dedup"] = time.perf_counter() - phase_start
+        phase_start = time.perf_counter()
 
     # Assertions will be sorted in order of how much of the alternate
     # outcome space they rule out (most to least).
-    sorted_assertions = sorted(assertions)    
-    len_assertions = len(sorted_assertions)
-
-    final_audit = []
+    sorted_assertions = sorted(assertions.values(), \
+        key=lambda a: a.rule_out_size())
 
-    if sorted_assertions != []:
-        final_audit = [sorted_assertions.pop(0)]
-
-        for assertion in sorted_assertions:
-            subsumed = False
-            for fasrtn in final_audit:
-                if fasrtn.subsumes(assertion):
-                    fasrtn.rules_out.update(assertion.rules_out) 
-                    if log:
-                        print("{} SUBSUMES {}".format(fasrtn.to_str(),
-                            assertion.to_str()), file=stream)
-
-                    subsumed = True
-                    break
-
-            if not subsumed:
-                final_audit.append(assertion)
+    final_audit = remove_subsumed(sorted_assertions, log, stream=stream)
 
+    if stats != None:
+        stats.times["subsumption"] = time.perf_counter() - phase_start
 
     if log:
         print("===============================================", file=stream)
@@ -327,3 +904,181 @@ def compute_raire_assertions(
     return final_audit  
 
 
+def remove_subsumed(assertions, log, stream=sys.stdout):
+    '''
+    Returns the list of the given 'assertions', less those subsumed by an
+    assertion before them in the list that is kept (see
+    RaireAssertion.subsumes). Each assertion removed is merged into the
+    first kept assertion that subsumes it, which takes on the outcomes it
+    rules out.
+
+    An NENAssertion subsumes another if each outcome ruled out by the
+    other has a suffix among the outcomes it rules out. Rather than test
+    each pair of assertions, the tails ruled out by each kept NENAssertion
+    are indexed, so that those subsuming an assertion are found by looking
+    up the suffixes of the tails it rules out. The NEBAssertions kept are
+    tested in turn.
+
+    If 'log' is true, print logging statements to given 'stream'.
+    '''
+    final_audit = []
+
+    # Positions in 'final_audit' of the kept NEBAssertions, and of the kept
+    # NENAssertions that rule out at least one outcome (an NENAssertion
+    # that rules out no outcomes subsumes nothing).
+    neb_positions = []
+    nen_positions = []
+
+    # Map between each tail ruled out by a kept NENAssertion and the
+    # positions of those assertions in 'final_audit'.
+    index = {}
+
+    for assertion in assertions:
+        first = None
+
+        # NEBAssertions are never subsumed.
+        if isinstance(assertion, NENAssertion):
+            if not assertion.rules_out:
+                subsumers = set(nen_positions)
+            else:
+                subsumers = None
+                for ro in assertion.rules_out:
+                    found = set()
+                    for i in range(len(ro)):
+                        found.update(index.get(ro[i:], ()))
+
+                    subsumers = found if subsumers is None else \
+                        subsumers & found
+
+                    if not subsumers:
+                        break
+
+            if subsumers:
+                first = min(subsumers)
+
+            for pos in neb_positions:
+                if first != None and pos > first:
+                    break
+
+                if final_audit[pos].subsumes(assertion):
+                    first = pos
+                    break
+
+        if first is None:
+            if isinstance(assertion, NEBAssertion):
+                neb_positions.append(len(final_audit))
+
+            elif assertion.rules_out:
+                nen_positions.append(len(final_audit))
+                for ro in assertion.rules_out:
+                    index.setdefault(ro, set()).add(len(final_audit))
+
+            final_audit.append(assertion)
+            continue
+
+        fasrtn = final_audit[first]
+        fasrtn.rules_out.update(assertion.rules_out) 
+
+        if isinstance(fasrtn, NENAssertion):
+            for ro in assertion.rules_out:
+                index.setdefault(ro, set()).add(first)
+
+        if log:
+            print("{} SUBSUMES {}".format(fasrtn.to_str(),
+                assertion.to_str()), file=stream)
+
+    return final_audit
+
+
+def update_raire_assertions(contest, cvrs, batch, winner, asn_func, log, \
+    state_file, stream=sys.stdout, agap=0, tally_cache=None, executor=None, \
+    stats=None, time_limit=None, node_limit=None, agap_schedule=None):
+    """
+    Update the audit found by an earlier search for assertions for
+    'contest' once a batch of new ballots has been added to the contest.
+
+    Inputs:
+        contest        - the contest being audited, with tot_ballots
+                         counting all ballots (including the new batch).
+
+        cvrs           - all ballots for the contest, including the new
+                         batch (see compute_raire_assertions).
+
+        batch          - the ballots added since 'state_file' was saved,
+                         in any of the forms accepted for 'cvrs'.
+
+        state_file     - path of the file holding the state of the earlier
+                         search (see 'state_file' in compute_raire_assertions).
+                         It is replaced by the state of the updated search,
+                         so that further batches can be added in turn.
+
+        The remaining inputs are as for compute_raire_assertions.
+
+    Tallies are brought up to date from those of the batch, and every node
+    of the saved frontier, and each of its ancestors, is rescored. A new
+    lower bound on audit difficulty is found by diving, and the branch
+    below every node more difficult than this bound is searched again
+    (see update_search_state). The audit returned is valid for all
+    ballots, and is as difficult as that found by a new search (within
+    'agap', if given). If there is no saved state in 'state_file', a new
+    search is run (as by compute_raire_assertions).
+
+    In 'stats', ballots_scanned includes the rows of the batch scanned to
+    update the saved tallies.
+
+    Outputs:
+        A list of RaireAssertions to be audited (see
+        compute_raire_assertions).
+    """
+    ballots = contest_ballots(contest, cvrs)
+    batch = contest_ballots(contest, batch)
+
+    if list(ballots.candidates) != list(contest.candidates):
+        raise ValueError("Ballots for contest {} list different candidates"\
+            .format(contest.name))
+
+    if list(batch.candidates) != list(ballots.candidates):
+        raise ValueError("Batch of ballots for contest {} lists different "\
+            "candidates".format(contest.name))
+
+    state = load_checkpoint(state_file, audit_state_digest(contest, winner, \
+        asn_func), contest)
+
+    if state is None:
+        return compute_raire_assertions(contest, ballots, winner, asn_func, \
+            log, stream=stream, agap=agap, tally_cache=tally_cache, \
+            executor=executor, stats=stats, time_limit=time_limit, \
+            node_limit=node_limit, agap_schedule=agap_schedule, \
+            state_file=state_file)
+
+    if log:
+        print("Updating from {}".format(state_file), file=stream)
+
+    if tally_cache is None:
+        tally_cache = TallyCache(ballots)
+
+    scanned = tally_cache.scanned
+
+    state, audit_not_possible = update_search_state(state, contest, ballots,\
+        batch, asn_func, log, stream=stream, tally_cache=tally_cache, \
+        stats=stats)
+
+    stop_reason = "complete"
+
+    if not audit_not_possible:
+        phase_start = time.perf_counter()
+
+        audit_not_possible, stop_reason = search_assertions(state, contest, \
+            ballots, asn_func, log, stream=stream, agap=agap, \
+            tally_cache=tally_cache, executor=executor, stats=stats, \
+            time_limit=time_limit, node_limit=node_limit, \
+            agap_schedule=agap_schedule)
+
+        if stats != None:
+            stats.times["search"] += time.perf_counter() - phase_start
+
+    save_audit_state(state_file, state, contest, winner, asn_func, \
+        tally_cache, audit_not_possible)
+
+    return finish_search(state, audit_not_possible, stop_reason, log, \
+        stream=stream, stats=stats, tally_cache=tally_cache, scanned=scanned)
@@ -13,9 +13,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import io
 import sys
+import time
+import heapq
+import multiprocessing
 import numpy as np
 
+from bisect import bisect_left, bisect_right, insort
+
+from ballot_store import BallotStore, BallotStoreBuilder, BallotIdTable, \
+    BallotTrie, CVRStore, TallyCache, contest_ballots
+
 
 class Contest:
     def __init__(self, name, candidates, winner, total_auditable_ballots,\
@@ -26,8 +35,41 @@ class Contest:
         self.candidates = candidates
         self.tot_ballots = total_auditable_ballots
 
+        # Candidates are interned as their position in 'candidates', so
+        # that a set of candidates can be represented by an integer bitmask
+        # with bit 'i' set for the i'th candidate.
+        self.index = {c : i for i,c in enumerate(candidates)}
+        self.all_bits = (1 << len(candidates)) - 1
+
+        # Interned tuples of candidates, by bitmask (see candidates_in).
+        self._subsets = {}
+
+    def bitmask(self, cands):
+        '''
+        Returns an integer with bit 'i' set for each candidate in 'cands',
+        where 'i' is the candidate's interned index.
+        '''
+        bits = 0
+        for c in cands:
+            bits |= 1 << self.index[c]
+
+        return bits
+
+    def candidates_in(self, bits):
+        '''
+        Returns the tuple of candidates in the bitmask 'bits', in the order
+        in which they are listed in 'candidates'. The tuple for each
+        bitmask is created once, and shared by all callers.
+        '''
+        cands = self._subsets.get(bits)
+        if cands is None:
+            cands = self._subsets.setdefault(bits, tuple([c for i,c in \
+                enumerate(self.candidates) if bits >> i & 1]))
+
+        return cands
+
 
-def load_contests_from_txt(path):
+def load_contests_from_txt(path, weighted=False):
     """
         Format:
         First line is a comma separated list of candidate identifiers, either
@@ -45,17 +87,18 @@ def load_contests_from_txt(path):
         signature. 
 
         Use default contest name of "1".
+
+        Returns the list of contests and a CVRStore holding their ballots.
+        If 'weighted' is True, the ballots of each contest are held in a
+        weighted store with one row per distinct signature.
     """
 
-    contests = []
-    cvrs = {}
-    
     tot_auditable_ballots = 0
 
+    # The file is read one line at a time, with ballots passed straight to
+    # the store being built.
     with open(path, "r") as data:
-        lines = data.readlines()
-
-        toks = [line.strip() for line in lines[0].strip().split(',')]
+        toks = [line.strip() for line in next(data).strip().split(',')]
         windx = toks.index("winner")    
         winner = toks[windx+1]
         cands = toks[:windx]
@@ -64,10 +107,19 @@ def load_contests_from_txt(path):
         if "order" in toks:
             order = toks[windx+2:]
 
+        builder = BallotStoreBuilder(cands, weighted=weighted)
+
+        # Skip party identifiers and separator.
+        next(data)
+        next(data)
+
         bcntr = 0
 
-        for l in range(3, len(lines)):
-            toks = [line.strip() for line in lines[l].strip().split(':')]
+        for line in data:
+            if not line.strip():
+                continue
+
+            toks = [tok.strip() for tok in line.strip().split(':')]
         
             num = int(toks[1])
 
@@ -78,177 +130,257 @@ def load_contests_from_txt(path):
             if prefs == []:
                 continue
 
-            for i in range(num):
-                ballot = {}
-                for c in cands:
-                    if c in prefs:
-                        idx = prefs.index(c)
-                        ballot[c] = idx
+            builder.add(prefs, ballot_id=bcntr, count=num)
 
-                cvrs[bcntr] = {1 : ballot}
+            bcntr += num
 
-                bcntr += 1
+        cvrs = CVRStore({1 : builder.build()}, ballot_key=int)
 
-        return [Contest(1, cands, winner, total_auditable_ballots, \
+        return [Contest(1, cands, winner, tot_auditable_ballots, \
             order=order)], cvrs
 
 
-def load_contests_from_raire_raw(txt):
+def parse_raire_contest(line):
     """
-    Raw text in raire format.
+    Parse a contest description line of a .raire data file, returning the
+    contest id, list of candidates, winner, outcome (if given), and number
+    of informal ballots.
     """
-    contests = []
+    toks = [tok.strip() for tok in line.strip().split(',')]
 
-    # A map between ballot id and the relevant CVR.
-    cvrs = {}
+    # Get contest id and number of candidates in that contest
+    cid = toks[1]
+    ncands = int(toks[2])
 
-    lines = txt.split('\n')
+    # Get list of candidate identifiers
+    cands = []
 
-    # Total number of contests described in data file
-    ncontests = int(lines[0])
+    for j in range(ncands):
+        cands.append(toks[3+j])
 
-    # Map between contest id and number of ballots involving that contest
-    num_ballots = {}
+    windx = toks.index("winner")    
+    winner = toks[windx+1]
 
-    # Map between contest id and the candidates & winner of that contest.
-    contest_info = {}
+    informal = 0
+    inf_index = None
+    if "informal" in toks:
+        inf_index = toks.index("informal")
+        informal = int(toks[inf_index+1])
 
-    for i in range(ncontests):
-        toks = [line.strip() for line in lines[1 + i].strip().split(',')]
+    order = []
+    if "order" in toks:
+        order = toks[windx+2:inf_index] if inf_index != None else \
+            toks[windx+2:]
 
-        # Get contest id and number of candidates in that contest
-        cid = toks[1]
-        ncands = int(toks[2])
+    return cid, cands, winner, order, informal
 
-        # Get list of candidate identifiers
-        cands = []
 
-        for j in range(ncands):
-            cands.append(toks[3 + j])
+def read_raire_header(lines):
+    """
+    Read the header of a .raire data file (the number of contests, and a
+    line describing each contest) from the iterator 'lines', leaving it
+    positioned at the first ballot record. Returns a list of contest
+    descriptions, as given by parse_raire_contest.
+    """
+    ncontests = int(next(lines))
 
-        windx = toks.index("winner")
-        winner = toks[windx + 1]
+    return [parse_raire_contest(next(lines)) for i in range(ncontests)]
 
-        informal = 0
-        inf_index = None
-        if "informal" in toks:
-            inf_index = toks.index("informal")
-            informal = int(toks[inf_index + 1])
 
-        order = []
-        if "order" in toks:
-            order = toks[windx + 2:inf_index] if inf_index != None else \
-                toks[windx + 2:]
+def iter_raire_ballots(lines):
+    """
+    Yield the ballot records in the iterable 'lines' (the ballot section
+    of a .raire data file) one at a time, as triples of contest id, ballot
+    id, and list of preferences. Blank lines are skipped.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
 
-        contest_info[cid] = (cands, winner, order)
-        num_ballots[cid] = informal
+        toks = [tok.strip() for tok in line.strip().split(',')]
+
+        yield toks[0], toks[1], toks[2:]
+
+
+def load_contests_from_raire_lines(lines, weighted=False):
+    """
+    Load contests and ballots from the lines of a .raire data file. The
+    input 'lines' may be any iterable over lines (such as an open file);
+    it is consumed one line at a time, so that memory use grows with the
+    ballot stores being built rather than with the size of the input.
+
+    Returns the list of contests and a CVRStore holding their ballots. If
+    'weighted' is True, the ballots of each contest are held in a weighted
+    store, with ballots that share the same ranking collapsed into a single
+    row.
+    """
+    lines = iter(lines)
 
-    for l in range(ncontests + 1, len(lines)):
-        toks = [line.strip() for line in lines[l].strip().split(',')]
+    header = read_raire_header(lines)
 
-        cid = toks[0]
-        bid = toks[1]
-        prefs = toks[2:]
+    builders, num_ballots, ballot_names = parse_raire_ballots(lines, \
+        header, weighted=weighted)
 
-        ballot = {}
-        for c in contest_info[cid][0]:
-            if c in prefs:
-                idx = prefs.index(c)
-                ballot[c] = idx
+    return raire_contests(header, builders, num_ballots, ballot_names)
+
+
+def parse_raire_ballots(lines, header, weighted=False):
+    """
+    Parse the ballot records in the iterable 'lines', for the contests
+    described in 'header' (see read_raire_header).
+
+    Returns a triple: a map between contest id and the BallotStoreBuilder
+    holding the ballots of that contest; a map between contest id and the
+    number of records for that contest; and the list of ballot identifiers
+    interned through a BallotIdTable (see CVRStore).
+    """
+    # Map between contest id and number of ballots involving that contest
+    num_ballots = {}
+
+    # Map between contest id and the builder accumulating its ballots.
+    builders = {}
+
+    for cid, cands, winner, order, informal in header:
+        num_ballots[cid] = 0
+        builders[cid] = BallotStoreBuilder(cands, weighted=weighted)
+
+    bids = BallotIdTable()
+
+    for cid, bid, prefs in iter_raire_ballots(lines):
+        builders[cid].add(prefs, ballot_id=None if weighted else \
+            bids.intern(bid))
 
         num_ballots[cid] += 1
 
-        if not bid in cvrs:
-            cvrs[bid] = {cid: ballot}
-        else:
-            cvrs[bid][cid] = ballot
+    return builders, num_ballots, bids.names
+
+
+def raire_contests(header, builders, num_ballots, ballot_names):
+    """
+    Form the list of contests, and the CVRStore holding their ballots, from
+    the 'header' of a .raire data file and the results of parsing its
+    ballots (see parse_raire_ballots).
+    """
+    contests = []
+
+    # Map between contest id and the candidates & winner of that contest.
+    contest_info = {}
 
-    for cid, (cands, winner, order) in contest_info.items():
-        con = Contest(cid, cands, winner, num_ballots[cid], order=order)
+    # Total number of ballots for each contest, including informal ballots.
+    totals = {}
+
+    for cid, cands, winner, order, informal in header:
+        contest_info[cid] = (cands, winner, order)
+        totals[cid] = informal
+
+    for cid,(cands,winner,order) in contest_info.items():
+        con = Contest(cid, cands, winner, totals[cid] + num_ballots[cid], \
+            order=order)
 
         contests.append(con)
 
+    cvrs = CVRStore({cid : b.build() for cid,b in builders.items()}, \
+        ballot_names=ballot_names)
+
     return contests, cvrs
 
 
-def load_contests_from_raire(path):
+def load_contests_from_raire_raw(txt, weighted=False):
+    """
+    Raw text in raire format.
+    """
+    return load_contests_from_raire_lines(io.StringIO(txt), \
+        weighted=weighted)
+
+
+def load_contests_from_raire(path, weighted=False, workers=1):
     """
         Data file in .raire format.
+
+        If 'workers' is greater than 1, the ballots are parsed in parallel
+        (see load_contests_from_raire_parallel).
     """
-    contests = []
+    if workers > 1:
+        return load_contests_from_raire_parallel(path, workers, \
+            weighted=weighted)
 
-    # A map between ballot id and the relevant CVR. 
-    cvrs = {}
     with open(path, "r") as data:
-        lines = data.readlines()
+        return load_contests_from_raire_lines(data, weighted=weighted)
 
-        # Total number of contests described in data file
-        ncontests = int(lines[0])
 
-        # Map between contest id and number of ballots involving that contest
-        num_ballots = {}
+def _parse_raire_chunk(path, start, end, encoding, header, weighted):
+    # Parse the ballot records held in bytes [start, end) of the file
+    # 'path', a range that begins and ends at line boundaries.
+    def lines():
+        with open(path, "rb") as data:
+            data.seek(start)
 
-        # Map between contest id and the candidates & winner of that contest.
-        contest_info = {}
+            pos = start
+            for raw in data:
+                if pos >= end:
+                    break
 
-        for i in range(ncontests):
-            toks = [line.strip() for line in lines[1+i].strip().split(',')]
+                pos += len(raw)
+                yield raw.decode(encoding)
 
-            # Get contest id and number of candidates in that contest
-            cid = toks[1]
-            ncands = int(toks[2])
+    return parse_raire_ballots(lines(), header, weighted=weighted)
 
-            # Get list of candidate identifiers
-            cands = []
 
-            for j in range(ncands):
-                cands.append(toks[3+j])
+def load_contests_from_raire_parallel(path, workers, weighted=False):
+    """
+    Load contests and ballots from the .raire data file 'path', splitting
+    the ballot section of the file into 'workers' chunks (at line
+    boundaries) that are parsed by a pool of worker processes. The ballots
+    from each chunk are then merged, in file order, so that the result is
+    identical to that of load_contests_from_raire.
+    """
+    with open(path, "r") as data:
+        encoding = data.encoding
 
-            windx = toks.index("winner")    
-            winner = toks[windx+1]
+    with open(path, "rb") as data:
+        header = read_raire_header(raw.decode(encoding) for raw in data)
 
-            informal = 0
-            inf_index = None
-            if "informal" in toks:
-                inf_index = toks.index("informal")
-                informal = int(toks[inf_index+1])
+        # Offsets of the first byte of each chunk; each chunk is extended
+        # to the end of the line in which it would otherwise end.
+        start = data.tell()
+        size = data.seek(0, 2)
 
-            
-            order = []
-            if "order" in toks:
-                order = toks[windx+2:inf_index] if inf_index != None else \
-                    toks[windx+2:]
-            
-            contest_info[cid] = (cands, winner, order)
-            num_ballots[cid] = informal
+        bounds = [start]
+        for k in range(1, workers):
+            pos = max(bounds[-1], start + ((size - start)*k)//workers)
+            if pos > start:
+                data.seek(pos - 1)
+                data.readline()
+                pos = data.tell()
 
-        for l in range(ncontests+1,len(lines)):
-            toks = [line.strip() for line in lines[l].strip().split(',')]
-        
-            cid = toks[0]
-            bid = toks[1]
-            prefs = toks[2:]
+            bounds.append(pos)
 
-            ballot = {}
-            for c in contest_info[cid][0]:
-                if c in prefs:
-                    idx = prefs.index(c)
-                    ballot[c] = idx
+        bounds.append(size)
 
-            num_ballots[cid] += 1
+    chunks = [(path, s, e, encoding, header, weighted) for s,e in \
+        zip(bounds, bounds[1:]) if e > s]
 
-            if not bid in cvrs:
-                cvrs[bid] = {cid: ballot}
-            else:
-                cvrs[bid][cid] = ballot
+    with multiprocessing.Pool(min(workers, max(len(chunks), 1))) as pool:
+        parts = pool.starmap(_parse_raire_chunk, chunks)
 
-        for cid,(cands,winner,order) in contest_info.items():
-            con = Contest(cid, cands, winner, num_ballots[cid], order=order)
+    builders = {cid : BallotStoreBuilder(cands, weighted=weighted) \
+        for cid, cands, winner, order, informal in header}
 
-            contests.append(con)
+    num_ballots = {cid : 0 for cid in builders}
 
+    bids = BallotIdTable()
 
-    return contests, cvrs
+    for part_builders, part_counts, part_names in parts:
+        # Ballot identifiers interned within a chunk are re-interned in
+        # file order.
+        id_map = np.array([bids.intern(n) for n in part_names], \
+            dtype=np.int64)
+
+        for cid, builder in part_builders.items():
+            builders[cid].absorb(builder, id_map=id_map)
+            num_ballots[cid] += part_counts[cid]
+
+    return raire_contests(header, builders, num_ballots, bids.names)
 
 
 def index_of(cand, list_of_cand):
@@ -292,7 +424,8 @@ def vote_for_cand(cand, eliminated, ballot):
     '''
     Input:
         cand                -   identifier for candidate
-        eliminated : list   -   identifiers of eliminated candidates
+        eliminated          -   identifiers of eliminated candidates (a list
+                                or, for faster lookups, a set)
         ballot              -   mapping between candidate name and their 
                                 position in the ranking for a relevant contest
                                 on a given ballot.
@@ -324,6 +457,11 @@ def vote_for_cand(cand, eliminated, ballot):
 
 
 class RaireAssertion:
+    # A search may hold many assertions, so their attributes are kept in
+    # slots rather than a per-object dictionary.
+    __slots__ = ("contest", "winner", "loser", "votes_for_winner", \
+        "votes_for_loser", "margin", "difficulty", "rules_out")
+
     def __init__(self, contest_name, winner, loser):
         """
         Initializes a RAIRE assertion involving a comparison between
@@ -395,25 +533,30 @@ class RaireAssertion:
         '''
         pass
 
+    def key(self):
+        '''
+        Returns a hashable key for this assertion, such that two assertions
+        have equal keys exactly when they are the same assertion (see
+        same_as).
+        '''
+        pass
+
+    def rule_out_size(self):
+        '''
+        Returns the length of the shortest tail in 'rules_out' (-1 if
+        there are none). The shorter this tail, the more alternate
+        outcomes the assertion rules out.
+        '''
+        return -1 if not self.rules_out else \
+            min([len(ro) for ro in self.rules_out])
+
     # Assertions are ordered in terms of how many alternate outcomes that
     # they are able to rule out. 
     def __lt__(self, other):
-        self_rule_out = -1 if not self.rules_out else \
-            min([len(ro) for ro in self.rules_out])
-
-        other_rule_out = -1 if not other.rules_out else \
-            min([len(ro) for ro in other.rules_out])
-
-        return self_rule_out < other_rule_out
+        return self.rule_out_size() < other.rule_out_size()
 
     def __gt__(self, other):
-        self_rule_out = -1 if not self.rules_out else \
-            min([len(ro) for ro in self.rules_out])
-
-        other_rule_out = -1 if not other.rules_out else \
-            min([len(ro) for ro in other.rules_out])
-
-        return self_rule_out > other_rule_out
+        return self.rule_out_size() > other.rule_out_size()
     
     def display(self, stream=sys.stdout):
         print(self.to_str(), file=stream)
@@ -442,6 +585,8 @@ class NEBAssertion(RaireAssertion):
     prior to 'loser'.  
     """
 
+    __slots__ = ()
+
     def __init__(self, contest_name, winner, loser):
         super().__init__(contest_name, winner, loser)
 
@@ -465,6 +610,9 @@ class NEBAssertion(RaireAssertion):
         return self.contest == other.contest and self.winner == other.winner\
             and self.loser == other.loser
 
+    def key(self):
+        return (NEBAssertion, self.contest, self.winner, self.loser)
+
     def subsumes(self, other):
         '''
         An NEBAssertion 'A' subsumes an assertion 'other' if:
@@ -481,11 +629,11 @@ class NEBAssertion(RaireAssertion):
             return True
 
         if self.winner == other.winner and not(self.loser in \
-            other.eliminated):
+            other.eliminated_set):
             return True
 
-        elif self.winner in other.eliminated and not(self.loser in \
-            other.eliminated):
+        elif self.winner in other.eliminated_set and not(self.loser in \
+            other.eliminated_set):
             return True
           
         else:
@@ -548,28 +696,62 @@ class NENAssertion(RaireAssertion):
     of 'loser'. 
     """
 
-    def __init__(self, contest_name, winner, loser, eliminated):
+    __slots__ = ("eliminated", "eliminated_bits", "_eliminated_set")
+
+    def __init__(self, contest_name, winner, loser, eliminated, \
+        eliminated_bits=None):
         super().__init__(contest_name, winner, loser)
 
         self.eliminated = eliminated
 
+        # Bitmask of the candidates in 'eliminated' (see Contest.bitmask),
+        # if known.
+        self.eliminated_bits = eliminated_bits
+
+        self._eliminated_set = None
+
+    @property
+    def eliminated_set(self):
+        '''
+        The candidates in 'eliminated', as a frozenset (created on first
+        use).
+        '''
+        if self._eliminated_set is None:
+            self._eliminated_set = frozenset(self.eliminated)
+
+        return self._eliminated_set
+
     def is_vote_for_winner(self, cvr):
         if not self.contest in cvr:
             return 0
 
-        return vote_for_cand(self.winner, self.eliminated, cvr[self.contest])
+        return vote_for_cand(self.winner, self.eliminated_set, \
+            cvr[self.contest])
         
     def is_vote_for_loser(self, cvr):
         if not self.contest in cvr:
             return 0
 
-        return vote_for_cand(self.loser, self.eliminated, cvr[self.contest])
+        return vote_for_cand(self.loser, self.eliminated_set, \
+            cvr[self.contest])
 
     def same_as(self, other):
-        return self.contest == other.contest \
-            and self.winner == other.winner \
-            and self.loser == other.loser \
-            and self.eliminated == other.eliminated 
+        if self.contest != other.contest or self.winner != other.winner \
+            or self.loser != other.loser:
+            return False
+
+        if self.eliminated_bits is not None and \
+            other.eliminated_bits is not None:
+            return self.eliminated_bits == other.eliminated_bits
+
+        return self.eliminated == other.eliminated 
+
+    def key(self):
+        eliminated = self.eliminated_bits if self.eliminated_bits is not \
+            None else tuple(self.eliminated)
+
+        return (NENAssertion, self.contest, self.winner, self.loser, \
+            eliminated)
 
     def subsumes(self, other):
         '''
@@ -613,11 +795,26 @@ class NENAssertion(RaireAssertion):
             
 
 class RaireNode:
-    def __init__(self, tail):
+    # Frontiers can hold millions of nodes, so node attributes are kept in
+    # slots rather than a per-object dictionary.
+    __slots__ = ("tail", "bits", "best_assertion", "best_ancestor", \
+        "expandable", "estimate", "explored", "explored_bits", "dive_node")
+
+    def __init__(self, tail, bits=None):
+        # Callers may give the tail as a list, and omit its bitmask, which
+        # is then computed when first needed (see RaireNode.bitmask).
+        if bits == None:
+            tail = tuple(tail)
+
         # Tail of an "imagined" elimination sequence representing the 
         # outcome of an IRV election. The last candidate in the tail is
-        # the "imagined" winner of the election.
-        self.tail = tail # List of str (candidate identifiers)
+        # the "imagined" winner of the election. The tail is a tuple, and
+        # is shared with the assertions that rule it out.
+        self.tail = tail # Tuple of str (candidate identifiers)
+
+        # Bitmask of the candidates in self.tail (see Contest.bitmask), or
+        # None if not yet computed.
+        self.bits = bits
 
         # Lowest cost assertion that, if true, can rule out any election
         # outcome that *ends* with the given tail.
@@ -640,11 +837,33 @@ class RaireNode:
         # considered (for example, through diving). These children are
         # represented by the candidate that was added to the front of
         # self.tail when the child was created.
-        self.explored = []
+        self.explored = ()
+
+        # Bitmask of the candidates in self.explored.
+        self.explored_bits = 0
 
         # Flag to indicate if node was created as part of a dive.
         self.dive_node = False
 
+    @classmethod
+    def from_tail(cls, contest, tail):
+        '''
+        Returns a node for the outcome ending with 'tail' (a sequence of
+        candidate identifiers) in 'contest', with its bitmask.
+        '''
+        tail = tuple(tail)
+        return cls(tail, contest.bitmask(tail))
+
+    def bitmask(self, contest):
+        '''
+        Returns the bitmask of the candidates in this node's tail, computing
+        it for 'contest' if the node was created without it.
+        '''
+        if self.bits == None:
+            self.bits = contest.bitmask(self.tail)
+
+        return self.bits
+
     def is_descendent_of(self, node):
         '''
         Determines if the given 'node' is an ancestor of this node in a
@@ -663,6 +882,10 @@ class RaireNode:
 
         if l1 <= l2: return False
 
+        # Every candidate in the tail of an ancestor is in this node's tail.
+        if node.bits != None and self.bits != None and \
+            node.bits & ~self.bits: return False
+
         return self.tail[l1-l2:] == node.tail
 
     def display(self, stream=sys.stdout):
@@ -686,9 +909,134 @@ class RaireNode:
         print("")
 
 
+class _FrontierEntry:
+    '''
+    A single occurrence of a node on the frontier (a node may be inserted
+    more than once). The estimate and expandable flag are fixed at the
+    time of insertion, as in the original list-based frontier.
+    '''
+    __slots__ = ("node", "estimate", "expandable", "time", "level", "key", \
+        "alive", "trie")
+
+    def __init__(self, node, time):
+        self.node = node
+        self.estimate = node.estimate
+        self.expandable = node.expandable
+        self.time = time
+        self.level = None
+        self.key = None
+        self.alive = True
+        self.trie = None
+
+
+class _TailTrieNode:
+    '''
+    Node of the frontier's tail index: a trie over reversed tails, rooted
+    at the hypothesised winner. The entries stored at a trie node are
+    those whose tail spells out the path from the root; all descendents
+    of a RaireNode therefore lie strictly below the trie node for its tail.
+    '''
+    __slots__ = ("entries", "children", "parent", "cand")
+
+    def __init__(self, parent=None, cand=None):
+        self.entries = []
+        self.children = {}
+        self.parent = parent
+        self.cand = cand
+
+
+class _FrontierLevel:
+    '''
+    Frontier entries sharing a running minimum estimate (see RaireFrontier).
+    Expandable entries are only counted; leaf entries are kept in order of
+    insertion, with removed entries dropped lazily.
+    '''
+    __slots__ = ("expandable", "leaves")
+
+    def __init__(self):
+        self.expandable = 0
+        self.leaves = []
+
+
 class RaireFrontier:
+    '''
+    Frontier of the RAIRE search, ordered as follows: expandable nodes with
+    no "invalidating" assertion (most recently inserted first); then
+    expandable nodes each placed before the first node with an estimate
+    no larger than its own; then leaves, appended in order of insertion.
+
+    The order is maintained in a heap. Because a node is only ever placed
+    ahead of nodes with an estimate no larger than its own, the position
+    of each node is determined by the minimum estimate over itself and all
+    nodes before it (its "level"). Entries are keyed by:
+
+        (0, 0, -time)                  no-assertion expandable nodes
+        (1, -level, -time)             other expandable nodes
+        (1, -level, time)              leaves
+
+    The level of an expandable node is its own estimate. A leaf takes the
+    smaller of its estimate and the lowest level on the frontier. When the
+    node that sets the level for a group of leaves is removed, those
+    leaves are re-keyed; leaves are never re-keyed to a lower level, so
+    this work is bounded by the number of distinct levels a leaf passes
+    through. Removal is lazy: stale heap entries are discarded when they
+    reach the top. A separate max-heap tracks the largest estimate on the
+    frontier.
+
+    Frontier entries are also indexed by a trie over their reversed tails,
+    so that replace_descendents only visits the subtree being removed.
+    '''
     def __init__(self):
-        self.nodes = []
+        self._trie = _TailTrieNode()
+        self._heap = []
+        self._max_heap = []
+        self._levels = {}
+        self._level_values = []
+        self._time = 0
+        self._size = 0
+
+        # Number of nodes removed by replace_descendents.
+        self.removed = 0
+
+
+    @property
+    def nodes(self):
+        '''
+        Nodes on the frontier, in frontier order.
+        '''
+        return [e.node for e in self._entries()]
+
+
+    def __len__(self):
+        return self._size
+
+
+    def front(self):
+        '''
+        Return the node at the front of the frontier (None if empty).
+        '''
+        entry = self._top()
+        return None if entry is None else entry.node
+
+
+    def pop_front(self):
+        '''
+        Remove and return the node at the front of the frontier.
+        '''
+        entry = self._top()
+        self._remove(entry)
+        return entry.node
+
+
+    def max_estimate(self):
+        '''
+        Return the largest estimate on the frontier (-inf if empty).
+        '''
+        heap = self._max_heap
+        while heap and not heap[0][2].alive:
+            heapq.heappop(heap)
+
+        return -heap[0][0] if heap else -np.inf
 
 
     def replace_descendents(self, node, log, stream=sys.stdout):
@@ -698,25 +1046,29 @@ class RaireFrontier:
 
         If 'log' is true, print logging statements to given 'stream'.
         '''
-        descendents = []
-
         if log:
             print("Replacing descendents of ", file=stream, end='')
             node.display(stream=stream)
 
-        for i in range(len(self.nodes)):
-            node_at_i = self.nodes[i]
-
-            # Is node_at_i a descendent of the given node?
-            if node_at_i.is_descendent_of(node):
-                descendents.append(i)
-
-        for i in reversed(descendents):
+        # Collect descendents from the trie below 'node', in frontier order.
+        descendents = []
+        tnode = self._find(node.tail)
+        if tnode is not None:
+            stack = list(tnode.children.values())
+            while stack:
+                t = stack.pop()
+                descendents.extend(t.entries)
+                stack.extend(t.children.values())
+
+        descendents.sort(key=lambda e: e.key)
+        self.removed += len(descendents)
+
+        for entry in reversed(descendents):
             if log:
                 print("Removing node: ", file=stream, end='')
-                self.nodes[i].display(stream=stream)
+                entry.node.display(stream=stream)
 
-            del self.nodes[i]
+            self._remove(entry)
 
         self.insert_node(node) 
 
@@ -734,23 +1086,23 @@ class RaireFrontier:
             node: RaireNode   - node, representing an alternate election
                                 outcome, to add to the frontier.
         '''
-        if not node.expandable:
-            self.nodes.append(node)
+        self._time += 1
+        entry = _FrontierEntry(node, self._time)
+        self._index(entry)
 
-        elif node.estimate == np.inf:
-            self.nodes.insert(0, node)
-
-        else:
-            i = 0
-            while i < len(self.nodes):
-                n_est = self.nodes[i].estimate
+        if not entry.expandable:
+            lowest = self._level_values[0] if self._level_values else np.inf
+            self._set_level(entry, min(lowest, entry.estimate))
 
-                if n_est <= node.estimate:
-                    break 
+        elif entry.estimate == np.inf:
+            entry.key = (0, 0, -entry.time)
+            heapq.heappush(self._heap, [entry.key, entry])
 
-                i += 1
+        else:
+            self._set_level(entry, entry.estimate)
 
-            self.nodes.insert(i, node)   
+        heapq.heappush(self._max_heap, (-entry.estimate, entry.time, entry))
+        self._size += 1
 
 
     def display(self, stream=sys.stdout):
@@ -758,7 +1110,286 @@ class RaireFrontier:
             node.display(stream=stream)
 
 
-def find_best_audit(contest, ballots, neb_matrix, node, asn_func) :
+    def _entries(self):
+        # Live entries in frontier order.
+        live = [item for item in self._heap \
+            if item[1].alive and item[1].key == item[0]]
+        live.sort()
+        return [e for _, e in live]
+
+
+    def _top(self):
+        heap = self._heap
+        while heap:
+            key, entry = heap[0]
+            if entry.alive and entry.key == key:
+                return entry
+            heapq.heappop(heap)
+
+        return None
+
+
+    def _set_level(self, entry, level):
+        lvl = self._levels.get(level)
+        if lvl is None:
+            lvl = self._levels[level] = _FrontierLevel()
+            insort(self._level_values, level)
+
+        entry.level = level
+        if entry.expandable:
+            entry.key = (1, -level, -entry.time)
+            lvl.expandable += 1
+        else:
+            entry.key = (1, -level, entry.time)
+            lvl.leaves.append(entry)
+
+        heapq.heappush(self._heap, [entry.key, entry])
+
+
+    def _find(self, tail):
+        # Trie node for the given tail (None if no such node).
+        tnode = self._trie
+        for c in reversed(tail):
+            tnode = tnode.children.get(c)
+            if tnode is None:
+                return None
+
+        return tnode
+
+
+    def _index(self, entry):
+        tnode = self._trie
+        for c in reversed(entry.node.tail):
+            child = tnode.children.get(c)
+            if child is None:
+                child = tnode.children[c] = _TailTrieNode(tnode, c)
+            tnode = child
+
+        tnode.entries.append(entry)
+        entry.trie = tnode
+
+
+    def _unindex(self, entry):
+        tnode = entry.trie
+        tnode.entries.remove(entry)
+        entry.trie = None
+
+        # Prune trie nodes that no longer lead to any entry.
+        while tnode.parent is not None and not tnode.entries \
+            and not tnode.children:
+            del tnode.parent.children[tnode.cand]
+            tnode = tnode.parent
+
+
+    def _remove(self, entry):
+        entry.alive = False
+        self._size -= 1
+        self._unindex(entry)
+
+        if entry.level is None:
+            return
+
+        lvl = self._levels[entry.level]
+        if entry.expandable:
+            lvl.expandable -= 1
+
+        self._release(entry.level)
+
+
+    def _release(self, level):
+        # Restore the level invariant after an entry at 'level' has been
+        # removed: every leaf at this level must be preceded by a node with
+        # estimate equal to 'level'. Expandable entries always are; leaves
+        # with no such node before them move up to a higher level.
+        lvl = self._levels[level]
+        if lvl.expandable > 0:
+            return
+
+        leaves = lvl.leaves
+        running = None
+        i = 0
+        while i < len(leaves):
+            entry = leaves[i]
+            if entry.alive:
+                if entry.estimate == level:
+                    break
+
+                if running is None:
+                    # Level of the nodes immediately before this one.
+                    j = bisect_right(self._level_values, level)
+                    running = self._level_values[j] \
+                        if j < len(self._level_values) else np.inf
+
+                running = min(running, entry.estimate)
+                self._set_level(entry, running)
+
+            i += 1
+
+        del leaves[:i]
+
+        if not leaves:
+            del self._levels[level]
+            self._level_values.pop(bisect_left(self._level_values, level))
+
+
+class SearchStats:
+    """
+    Counters and timers describing a run of compute_raire_assertions, which
+    fills in the SearchStats it is given:
+
+        nodes_created      nodes of the alternate outcome tree created
+        nodes_expanded     nodes whose children were created
+        nodes_dived        nodes created while diving (see perform_dive)
+        nodes_pruned       frontier nodes removed as an ancestor's assertion
+                           rules them out (see replace_descendents)
+        nodes_closed       expandable nodes made leaves, as their estimate
+                           is within the lower bound
+        find_best_audit    calls to find_best_audit
+        ballots_scanned    ballot rows (or trie nodes) scanned to compute
+                           tallies (see TallyCache)
+
+    'times' gives the wall time, in seconds, spent forming the NEB matrix
+    ("neb"), searching ("search"), removing duplicate assertions ("dedup")
+    and removing subsumed assertions ("subsumption").
+
+    'stop_reason' gives the reason the search stopped: "complete" (all
+    nodes on the frontier are leaves), "agap" (the bounds on difficulty
+    converged to within the allowed gap), "budget" (the time or node
+    budget was spent) or "not possible" (an audit is not possible).
+    'lower_bound' and 'max_estimate' are the lower bound on audit
+    difficulty and the largest estimate on the frontier when it stopped,
+    and 'gap' the difference between them.
+
+    'trajectory' samples the state of the search every 'sample_every' node
+    expansions, and whenever the lower bound changes, as tuples of: the
+    time since the search started; the number of nodes expanded; the size
+    of the frontier; the lower bound on audit difficulty; and the largest
+    estimate on the frontier. If given, 'callback' is called with this
+    SearchStats after each sample is taken.
+    """
+
+    def __init__(self, callback=None, sample_every=100):
+        self.callback = callback
+        self.sample_every = sample_every
+
+        self.nodes_created = 0
+        self.nodes_expanded = 0
+        self.nodes_dived = 0
+        self.nodes_pruned = 0
+        self.nodes_closed = 0
+        self.find_best_audit = 0
+        self.ballots_scanned = 0
+
+        self.times = {"neb" : 0, "search" : 0, "dedup" : 0, \
+            "subsumption" : 0}
+
+        self.trajectory = []
+
+        self.stop_reason = None
+        self.lower_bound = None
+        self.max_estimate = None
+        self.gap = None
+
+        self.start = time.perf_counter()
+
+    def sample(self, frontier, lowerbound, max_estimate, force=False):
+        '''
+        Record the state of the search, if 'sample_every' expansions have
+        passed since the last sample, the lower bound has changed, or
+        'force' is True.
+        '''
+        if not force and self.trajectory:
+            last = self.trajectory[-1]
+            if lowerbound == last[3] and self.nodes_expanded - last[1] < \
+                self.sample_every:
+                return
+
+        self.trajectory.append((time.perf_counter() - self.start, \
+            self.nodes_expanded, len(frontier), lowerbound, max_estimate))
+
+        if self.callback != None:
+            self.callback(self)
+
+    def to_json(self):
+        '''
+        Returns a dictionary of these statistics that can be serialised as
+        JSON (infinite bounds are given as None).
+        '''
+        def finite(x):
+            return float(x) if x != None and np.isfinite(x) else None
+
+        return {
+            "nodes_created" : self.nodes_created,
+            "nodes_expanded" : self.nodes_expanded,
+            "nodes_dived" : self.nodes_dived,
+            "nodes_pruned" : self.nodes_pruned,
+            "nodes_closed" : self.nodes_closed,
+            "find_best_audit" : self.find_best_audit,
+            "ballots_scanned" : self.ballots_scanned,
+            "times" : dict(self.times),
+            "stop_reason" : self.stop_reason,
+            "lower_bound" : finite(self.lower_bound),
+            "max_estimate" : finite(self.max_estimate),
+            "gap" : finite(self.gap),
+            "trajectory" : [[t, n, size, finite(lb), finite(mx)] for \
+                t,n,size,lb,mx in self.trajectory],
+        }
+
+
+def compute_neb_matrix(contest, ballots, asn_func, tallies=None):
+    '''
+    Input:
+    contest: Contest   -  Contest being audited.
+
+    ballots            -  Details of reported ballots for this contest
+                          (BallotStore).
+
+    asn_func: Callable -  Function that takes an assertion margin and 
+                          returns an estimate of how "difficult" it will
+                          be to audit that assertion.
+
+    tallies            -  The pair (first, above) returned by
+                          ballots.neb_tallies(), if already computed
+                          (optional).
+
+    Output:
+    Returns a |Candidates| x |Candidates| dictionary where M[c1][c2] is a
+    NEBAssertion stating that c1 cannot be eliminated before c2 (if one 
+    exists) and None otherwise. All tallies are taken from a single pass
+    over the ballots (see BallotStore.neb_tallies).
+    '''
+    nebs = {c : { d : None for d in contest.candidates} 
+        for c in contest.candidates} 
+
+    first, above = ballots.neb_tallies() if tallies is None else tallies
+
+    for c in contest.candidates:
+        ci = ballots.index[c]
+
+        for d in contest.candidates:
+            if c == d: 
+                continue
+
+            tally_c = int(first[ci])
+            tally_d = int(above[ci, ballots.index[d]])
+
+            if tally_c > tally_d:
+                asrn = NEBAssertion(contest.name, c, d)
+
+                asrn.difficulty = float(asn_func(tally_c, tally_d, \
+                    contest.tot_ballots - (tally_c + tally_d), \
+                    contest.tot_ballots))
+
+                asrn.votes_for_winner = tally_c
+                asrn.votes_for_loser = tally_d
+
+                nebs[c][d] = asrn
+
+    return nebs
+
+
+def find_best_audit(contest, ballots, neb_matrix, node, asn_func, \
+    tally_cache=None, parent_tally=None):
     '''
     Input:
     node: RaireNode    -  A node in the tree of alternate election outcomes.
@@ -767,7 +1398,9 @@ def find_best_audit(contest, ballots, neb_matrix, node, asn_func) :
 
     contest: Contest   -  Contest being audited.
 
-    ballots            -  Details of reported ballots for this contest.
+    ballots            -  Details of reported ballots for this contest
+                          (BallotStore or BallotTrie, or a list of ballots
+                          in the legacy dictionary representation).
 
     neb_matrix         -  |Candidates| x |Candidates| dictionary where 
                           neb_matrix[c1][c2] returns a NEBAssertion stating
@@ -778,6 +1411,13 @@ def find_best_audit(contest, ballots, neb_matrix, node, asn_func) :
                           returns an estimate of how "difficult" it will
                           be to audit that assertion.
 
+    tally_cache        -  TallyCache over 'ballots' used to look up the
+                          tallies of candidates in node.tail (optional).
+
+    parent_tally       -  Vector of candidate tallies for the parent of
+                          'node' (whose tail is node.tail[1:]), from which
+                          the tallies for 'node' can be derived (optional).
+
     Output:
     Finds the least cost assertion that can be used to rule out all election 
     outcomes that end with the sequence node.tail, and assigns that assertion
@@ -785,6 +1425,9 @@ def find_best_audit(contest, ballots, neb_matrix, node, asn_func) :
     will equal None after this function is called.
     '''
 
+    if not isinstance(ballots, (BallotStore, BallotTrie)):
+        ballots = BallotStore.from_ballots(contest.candidates, ballots)
+
     ntail = len(node.tail)
     first_in_tail = node.tail[0]
 
@@ -805,7 +1448,8 @@ def find_best_audit(contest, ballots, neb_matrix, node, asn_func) :
 
 
     # 'eliminated' is the list of candidates that are not mentioned in 'tail'.
-    eliminated = [c for c in contest.candidates if not c in node.tail]
+    eliminated_bits = contest.all_bits & ~node.bitmask(contest)
+    eliminated = contest.candidates_in(eliminated_bits)
 
     # We now look at whether there is a candidate not mentioned in 
     # 'tail' (this means they are assumed to be eliminated at some prior
@@ -825,26 +1469,36 @@ def find_best_audit(contest, ballots, neb_matrix, node, asn_func) :
     # remain, 'first_in_tail' is not the candidate with the least number
     # of votes. This means that 'first_in_tail' should not be eliminated next.
 
+    # Tallies of the candidates in 'tail' once 'eliminated' are eliminated.
+    first_idx = ballots.index[first_in_tail]
+
+    if tally_cache != None:
+        tallies = tally_cache.tally(node.bits, parent_tally=parent_tally, \
+            cand=first_idx)
+    elif parent_tally is not None:
+        tallies = ballots.child_tally(ballots.bits_to_mask(node.bits), \
+            parent_tally, first_idx)
+    else:
+        tallies = ballots.tally(ballots.bits_to_mask(node.bits))
+
     # Tally of the candidate 'first_in_tail'
-    tally_first_in_tail = sum([vote_for_cand(first_in_tail, \
-        eliminated, blt) for blt in ballots])
+    tally_first_in_tail = int(tallies[first_idx])
 
     for later_cand in node.tail[1:]:
-        tally_later_cand =  sum([vote_for_cand(later_cand, \
-            eliminated, blt) for blt in ballots])
+        tally_later_cand = int(tallies[ballots.index[later_cand]])
 
         if  tally_first_in_tail > tally_later_cand:
             # We can create a NEN assertion that says "first_in_cand"
             # should not be eliminated next, after "eliminated" are
             # eliminated, because "later_cand" actually has less votes
             # at this point.
-            estimate = asn_func(tally_first_in_tail, tally_later_cand, \
-                contest.tot_ballots - (tally_first_in_tail + tally_later_cand),\
-                contest.tot_ballots)
+            estimate = float(asn_func(tally_first_in_tail, \
+                tally_later_cand, contest.tot_ballots - (tally_first_in_tail \
+                + tally_later_cand), contest.tot_ballots))
 
             if best_asrtn is None or estimate < best_asrtn.difficulty:
                 nen = NENAssertion(contest, first_in_tail, later_cand, \
-                    eliminated)
+                    eliminated, eliminated_bits=eliminated_bits)
 
                 nen.rules_out.add(tuple(node.tail))
                 nen.difficulty = estimate
@@ -860,6 +1514,40 @@ def find_best_audit(contest, ballots, neb_matrix, node, asn_func) :
         node.estimate = best_asrtn.difficulty
 
 
+def evaluate_nodes(nodes, contest, ballots, neb_matrix, asn_func, \
+    tally_cache=None, parent_tally=None, executor=None):
+    '''
+    Input:
+    nodes              -  List of RaireNodes, the children of a common
+                          parent node, to be evaluated.
+
+    contest, ballots, neb_matrix, asn_func, tally_cache, parent_tally
+                       -  As for find_best_audit.
+
+    executor           -  A concurrent.futures.ThreadPoolExecutor on which
+                          to evaluate the nodes concurrently (optional). The
+                          evaluation of each node is independent of the
+                          others. Nodes are evaluated by a local function
+                          that updates them in place, so a process pool
+                          cannot be used.
+
+    Output:
+    Returns an iterator over the given nodes, in order, yielding each node
+    once find_best_audit has been applied to it. Without an executor, each
+    node is only evaluated when it is requested from the iterator.
+    '''
+    def evaluate(node):
+        find_best_audit(contest, ballots, neb_matrix, node, asn_func, \
+            tally_cache=tally_cache, parent_tally=parent_tally)
+
+        return node
+
+    if executor is None:
+        return map(evaluate, nodes)
+
+    return executor.map(evaluate, nodes)
+
+
 def manage_node(newn, frontier, lowerbound, log, stream=sys.stdout):
 
     '''
@@ -939,8 +1627,83 @@ def manage_node(newn, frontier, lowerbound, log, stream=sys.stdout):
         return False, lowerbound, False
 
 
+def dive_candidate(contest, bits):
+    '''
+    Returns the candidate added to a tail, whose candidates are given by
+    the bitmask 'bits', at the next step of a dive: the remaining candidate
+    eliminated last in the reported outcome (if known), and otherwise the
+    first remaining candidate.
+    '''
+    rem_cands = [c for i,c in enumerate(contest.candidates) \
+        if not bits >> i & 1]
+
+    # sort rem_cands by position in contest.order if it is defined
+    next_cand = rem_cands[0]
+    if contest.outcome != []:
+        npos = contest.outcome.index(next_cand)
+
+        for i in range(1, len(rem_cands)):
+            c = rem_cands[i]
+            ipos = contest.outcome.index(c)
+
+            if ipos > npos:
+                next_cand = c
+                npos = ipos
+
+    return next_cand
+
+
+def dive_bound(node, contest, ballots, neb_matrix, asn_func, \
+    tally_cache=None, stats=None):
+    '''
+    Input:
+    node: RaireNode    -  A node in the tree of alternate election outcomes,
+                          to which find_best_audit has been applied, and
+                          whose best ancestor is the least difficult of
+                          its ancestors (if it has any).
+
+    contest, ballots, neb_matrix, asn_func, tally_cache, stats
+                       -  As for perform_dive.
+
+    Output:
+    Returns a lower bound on audit difficulty, found by diving from 'node'
+    to a leaf as perform_dive does: the outcome at the leaf can only be
+    ruled out by an assertion for one of the nodes on its path, so the
+    audit is at least as difficult as the least difficult of these. Unlike
+    perform_dive, the nodes along the dive are not added to any frontier.
+    Returns np.inf if the leaf cannot be ruled out.
+    '''
+    ncands = len(contest.candidates)
+
+    bound = node.estimate
+    if node.best_ancestor != None:
+        bound = min(bound, node.best_ancestor.estimate)
+
+    node.bitmask(contest)
+
+    while len(node.tail) < ncands:
+        next_cand = dive_candidate(contest, node.bits)
+
+        newn = RaireNode((next_cand,) + node.tail, node.bits | 1 << \
+            contest.index[next_cand])
+
+        parent_tally = None if tally_cache is None else \
+            tally_cache.tally(node.bits)
+
+        find_best_audit(contest, ballots, neb_matrix, newn, asn_func, \
+            tally_cache=tally_cache, parent_tally=parent_tally)
+
+        if stats != None:
+            stats.find_best_audit += 1
+
+        bound = min(bound, newn.estimate)
+        node = newn
+
+    return bound
+
+
 def perform_dive(node, contest, ballots, neb_matrix, asn_func, lower_bound, \
-    frontier, log, stream=sys.stdout):
+    frontier, log, stream=sys.stdout, tally_cache=None, stats=None):
 
     '''
     Input:
@@ -949,7 +1712,8 @@ def perform_dive(node, contest, ballots, neb_matrix, asn_func, lower_bound, \
 
     contest: Contest   -  Contest being audited.
 
-    ballots:           -  Details of reported ballots for this contest.
+    ballots:           -  Details of reported ballots for this contest
+                          (BallotStore or BallotTrie).
 
     neb_matrix         -  |Candidates| x |Candidates| dictionary where 
                           neb_matrix[c1][c2] returns a NEBAssertion stating
@@ -971,6 +1735,14 @@ def perform_dive(node, contest, ballots, neb_matrix, asn_func, lower_bound, \
     stream             -  Stream to which logging statements should
                           be printed.
 
+    tally_cache        -  TallyCache over 'ballots' (optional). The
+                          tallies of each node on the dive are derived
+                          from those of its parent (see
+                          BallotStore.child_tally).
+
+    stats              -  SearchStats in which to count the nodes created
+                          by the dive (optional).
+
 
     Output:
     Returns the difficulty estimate of the least-difficult-to-audit 
@@ -982,33 +1754,33 @@ def perform_dive(node, contest, ballots, neb_matrix, asn_func, lower_bound, \
 
     ncands = len(contest.candidates)
 
-    rem_cands = [c for c in contest.candidates if not c in node.tail]
-
-    # sort rem_cands by position in contest.order if it is defined
-    next_cand = rem_cands[0]
-    if contest.outcome != []:
-        npos = contest.outcome.index(next_cand)
+    next_cand = dive_candidate(contest, node.bitmask(contest))
+    bit = 1 << contest.index[next_cand]
 
-        for i in range(1, len(rem_cands)):
-            c = rem_cands[i]
-            ipos = contest.outcome.index(c)
-
-            if ipos > npos:
-                next_cand = c
-                npos = ipos
-
-    newn = RaireNode([next_cand] + node.tail)
+    newn = RaireNode((next_cand,) + node.tail, node.bits | bit)
     newn.expandable = False if len(newn.tail) == ncands else True
     newn.dive_node = True
 
-    node.explored.append(next_cand)
+    node.explored += (next_cand,)
+    node.explored_bits |= bit
 
     # Assign a 'best ancestor' to the new node. 
     newn.best_ancestor = node.best_ancestor if \
         node.best_ancestor != None and node.best_ancestor.estimate <= \
         node.estimate else node
 
-    find_best_audit(contest, ballots, neb_matrix, newn, asn_func)
+    # Tallies for the continuing candidates of 'node', from which those of
+    # 'newn' are derived.
+    parent_tally = None if tally_cache is None else \
+        tally_cache.tally(node.bits)
+
+    find_best_audit(contest, ballots, neb_matrix, newn, asn_func, \
+        tally_cache=tally_cache, parent_tally=parent_tally)
+
+    if stats != None:
+        stats.nodes_created += 1
+        stats.nodes_dived += 1
+        stats.find_best_audit += 1
 
     if log:
         print("DIVE TESTED ", file=stream, end='')
@@ -1024,4 +1796,5 @@ def perform_dive(node, contest, ballots, neb_matrix, asn_func, lower_bound, \
         return next_lowerbound
 
     return perform_dive(newn, contest, ballots, neb_matrix, asn_func, \
-            next_lowerbound, frontier, log, stream=stream)
+            next_lowerbound, frontier, log, stream=stream, \
+            tally_cache=tally_cache, stats=stats)
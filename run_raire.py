@@ -15,14 +15,24 @@
 
 
 from raire_utils import *
-from raire import compute_raire_assertions
+from raire import compute_raire_assertions, update_raire_assertions
 from sample_estimator import *
+from ballot_store import SharedBallotStore
+from contest_cache import load_contests
+from simp_assertions import fill_outcome
 
 import numpy as np
 
+import io
+import os
 import sys
+import json
 import argparse
 import math
+import multiprocessing
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
 
 
 parser = argparse.ArgumentParser()
@@ -32,6 +42,51 @@ parser.add_argument('-v', dest='verbose', action='store_true')
 
 parser.add_argument('-agap', dest='agap', type=float, default=0)
 
+# Budget on the search for assertions, in seconds or nodes expanded. Once
+# spent, the search returns the audit formed from its current frontier (see
+# compute_raire_assertions).
+parser.add_argument('-time_limit', dest='time_limit', type=float, \
+    default=None)
+parser.add_argument('-node_limit', dest='node_limit', type=int, default=None)
+
+# Schedule on which to widen the allowed gap, as a list of SECONDS:GAP
+# pairs: once SECONDS have passed, the gap is widened to at least GAP.
+parser.add_argument('-agap_schedule', dest='agap_schedule', nargs='+', \
+    default=None, type=lambda p: tuple(float(x) for x in p.split(':')))
+
+# Memory cap (in MB) on the cache of candidate tallies kept during search.
+parser.add_argument('-tcache', dest='tcache', type=float, default=64)
+
+# Compute tallies by walking a prefix trie of the ballots.
+parser.add_argument('-trie', dest='trie', action='store_true')
+
+# Number of worker processes over which to spread contests (and to parse
+# the input file).
+parser.add_argument('-j', dest='jobs', type=int, default=1)
+
+# Number of threads on which to evaluate the children of each node expanded
+# in the search.
+parser.add_argument('-threads', dest='threads', type=int, default=1)
+
+# Directory to which statistics on the search for each contest's assertions
+# are written, as JSON (see SearchStats in raire_utils.py).
+parser.add_argument('-stats', dest='stats', default=None)
+
+# Directory in which the state of the search for each contest's assertions
+# is checkpointed, every 'checkpoint_interval' seconds. A rerun with the
+# same directory resumes each unfinished search from its checkpoint.
+parser.add_argument('-checkpoint', dest='checkpoint', default=None)
+parser.add_argument('-checkpoint_interval', dest='checkpoint_interval', \
+    type=float, default=300)
+
+# Directory in which the state of each contest's finished search is kept.
+# When a data file holding a batch of new ballots is given with -batch (the
+# ballots in -i already including them), the audit saved for each contest
+# is updated for the batch rather than computed anew (see
+# update_raire_assertions).
+parser.add_argument('-state', dest='state', default=None)
+parser.add_argument('-batch', dest='batch', default=None)
+
 # Used for estimating sample size for assertions if desired.
 parser.add_argument('-r', dest='rlimit', type=float, default=0.10)
 
@@ -43,18 +98,91 @@ parser.add_argument('-e2', dest='erate2', type=float, default=0)
 parser.add_argument('-seed', dest='seed', type=int, default=1234567)
 parser.add_argument('-reps', dest='reps', type=int, default=100)
 
-args = parser.parse_args()
+# SQLite database in which sample size estimates are kept across runs.
+parser.add_argument('-sscache', dest='sscache', default=None)
+
+# Estimate comparison audit sample sizes analytically, rather than by
+# simulation (see analytic_sample_size in sample_estimator.py).
+parser.add_argument('-fast', dest='fast', action='store_true')
+
+# Simulate samples in chunks drawn from the counts of each assorter value,
+# rather than shuffling the whole population (see chunked_sample_size).
+parser.add_argument('-chunked', dest='chunked', action='store_true')
 
 
-contests, cvrs = load_contests_from_raire(args.input)
+def audit_contest(contest, ballots, args, sample_cache=None, batch=None):
+    '''
+    Generate assertions for the given contest, estimate their sample sizes,
+    and print the results.
+
+    Input:
+    contest: Contest    -  Contest being audited.
+    ballots             -  BallotStore for the contest.
+    args                -  Parsed command line arguments.
+    sample_cache        -  SampleSizeCache for sample size estimates
+                           (optional).
+    batch               -  BallotStore of the new ballots for the contest,
+                           if any, when updating a saved audit (-state).
+    '''
+    est_fn = bp_estimate if args.bp else cp_estimate
+
+    # Dives in the search follow the tabulated elimination order if the data
+    # file does not give one.
+    fill_outcome(contest, ballots)
+
+    if args.trie:
+        ballots = BallotTrie(ballots)
+
+    tally_cache = TallyCache(ballots, max_bytes=int(args.tcache*2**20))
+
+    executor = ThreadPoolExecutor(args.threads) if args.threads > 1 else None
+
+    stats = SearchStats()
+
+    checkpoint = None
+    if args.checkpoint != None:
+        os.makedirs(args.checkpoint, exist_ok=True)
+        checkpoint = os.path.join(args.checkpoint, "contest-{}.ckpt".format(\
+            contest.name))
+
+    state_file = None
+    if args.state != None:
+        os.makedirs(args.state, exist_ok=True)
+        state_file = os.path.join(args.state, "contest-{}.state".format(\
+            contest.name))
+
+    # Logs are written to the current sys.stdout (which is redirected when
+    # running in a worker process).
+    if state_file != None and batch != None:
+        audit = update_raire_assertions(contest, ballots, batch, 
+            contest.winner, est_fn, args.verbose, state_file, 
+            stream=sys.stdout, agap=args.agap, tally_cache=tally_cache,
+            executor=executor, stats=stats, time_limit=args.time_limit,
+            node_limit=args.node_limit, agap_schedule=args.agap_schedule)
+    else:
+        audit = compute_raire_assertions(contest, ballots, contest.winner, 
+            est_fn, args.verbose, stream=sys.stdout, agap=args.agap,
+            tally_cache=tally_cache, executor=executor, stats=stats,
+            time_limit=args.time_limit, node_limit=args.node_limit,
+            agap_schedule=args.agap_schedule, checkpoint=checkpoint,
+            checkpoint_interval=args.checkpoint_interval, 
+            state_file=state_file)
+
+    if executor is not None:
+        executor.shutdown()
 
-est_fn = bp_estimate if args.bp else cp_estimate
+    if args.stats != None:
+        report = {"file" : args.input, "contest" : contest.name, \
+            "assertions" : len(audit), "search" : stats.to_json(), \
+            "tally_cache" : tally_cache.stats()}
 
-np.seterr(all="ignore")
+        os.makedirs(args.stats, exist_ok=True)
+        with open(os.path.join(args.stats, "contest-{}.json".format(\
+            contest.name)), "w") as out:
+            json.dump(report, out, indent=2)
 
-for contest in contests:
-    audit = compute_raire_assertions(contest, cvrs, contest.winner, 
-        est_fn, args.verbose, agap=args.agap)
+    if args.verbose:
+        print("Tally cache: {}".format(tally_cache.stats()))
 
     N = contest.tot_ballots
 
@@ -69,7 +197,9 @@ for contest in contests:
             tally_other = N - asrt.votes_for_winner - asrt.votes_for_loser
             amean = (asrt.votes_for_winner + 0.5*tally_other)/N
             est = sample_size(amean, asrt.votes_for_winner, \
-                asrt.votes_for_loser, tally_other, args, N, polling=args.bp)
+                asrt.votes_for_loser, tally_other, args, N, polling=args.bp, \
+                cache=sample_cache, analytic=args.fast, \
+                chunked=args.chunked)
 
             est = min(est, N) # Cut off at a full recount
 
@@ -79,7 +209,92 @@ for contest in contests:
             if args.verbose:
                 print("{}, est {},{}%".format(asrt.to_str(), est, est_p))
 
+        if args.verbose and sample_cache != None:
+            print("Sample size cache: {}".format(sample_cache.stats()))
+
+    if stats.stop_reason == "budget":
+        print(f"File {args.input}, Contest {contest.name}, budget spent, "\
+            f"lower bound {stats.lower_bound}, gap {stats.gap}")
+
     if max_est != 0:
         max_est = min(max_est, N)
         max_est_p = 100*(max_est/N)
         print(f"File {args.input}, Contest {contest.name}, asn {max_est}, {max_est_p:.2f}%")
+
+
+# State of a worker process when contests are run in parallel (-j). Ballots
+# are shared with workers through shared memory (see SharedBallotStore).
+_worker = {}
+
+def init_worker(args, contests, shared, shared_batches):
+    np.seterr(all="ignore")
+
+    _worker["args"] = args
+    _worker["contests"] = contests
+    _worker["shared"] = shared
+    _worker["batches"] = shared_batches
+    _worker["sample_cache"] = SampleSizeCache(args.sscache)
+
+
+def run_contest(i):
+    '''
+    Audit the i'th contest in a worker process, returning its output.
+    '''
+    contest = _worker["contests"][i]
+    ballots = _worker["shared"][contest.name].attach()
+
+    batch = None
+    if contest.name in _worker["batches"]:
+        batch = _worker["batches"][contest.name].attach()
+
+    output = io.StringIO()
+    with redirect_stdout(output):
+        audit_contest(contest, ballots, _worker["args"], \
+            sample_cache=_worker["sample_cache"], batch=batch)
+
+    return output.getvalue()
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    contests, cvrs = load_contests(args.input, weighted=True, \
+        workers=args.jobs)
+
+    # New ballots for each contest, by contest name.
+    batches = {}
+    if args.batch != None:
+        batch_contests, batch_cvrs = load_contests(args.batch, weighted=True)
+        batches = {c.name : contest_ballots(c, batch_cvrs) for c in \
+            batch_contests}
+
+    np.seterr(all="ignore")
+
+    if args.jobs <= 1:
+        sample_cache = SampleSizeCache(args.sscache)
+
+        for contest in contests:
+            audit_contest(contest, contest_ballots(contest, cvrs), args, \
+                sample_cache=sample_cache, batch=batches.get(contest.name))
+
+        sample_cache.close()
+
+    else:
+        shared = {c.name : SharedBallotStore(contest_ballots(c, cvrs)) \
+            for c in contests}
+        shared_batches = {name : SharedBallotStore(b) for name,b in \
+            batches.items()}
+
+        try:
+            with multiprocessing.Pool(args.jobs, initializer=init_worker, \
+                initargs=(args, contests, shared, shared_batches)) as pool:
+
+                # Output is printed in contest order, each contest as soon as
+                # it and all contests before it have finished.
+                for output in pool.imap(run_contest, range(len(contests))):
+                    print(output, end='', flush=True)
+        finally:
+            for s in shared.values():
+                s.unlink()
+            for s in shared_batches.values():
+                s.unlink()
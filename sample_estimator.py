@@ -15,13 +15,150 @@
 import numpy as np
 import statistics
 import math
+import sqlite3
+
+from collections import OrderedDict
 
 # Make sure shangrla is in your PYTHONPATH
 from shangrla.core.NonnegMean import NonnegMean
 from shangrla.core.Audit import Assertion
 
 
-def sample_size(mean, tw, tl, to, args, N, upper_bound=1, polling=False):
+class SampleSizeCache:
+    """
+    Memoizes sample size estimates (see sample_size). An estimate depends
+    only on the assertion's tallies, the number of ballots, and the
+    estimation settings (risk limit, error rates, replicates and seed), so
+    identical inputs always give the same estimate.
+
+    Estimates are held in an in-process LRU cache of at most 'max_entries'
+    entries and, if 'path' is given, in an SQLite database at that path, so
+    that they persist across runs (and are shared by concurrent runs).
+    """
+
+    def __init__(self, path=None, max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.db = None
+        if path != None:
+            self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+            self.db.execute("CREATE TABLE IF NOT EXISTS sample_sizes "\
+                "(key TEXT PRIMARY KEY, size)")
+
+    @staticmethod
+    def key(mean, tw, tl, to, args, N, upper_bound, polling, analytic=False,\
+        chunked=False):
+        return repr((float(mean), int(tw), int(tl), int(to), int(N), \
+            float(upper_bound), bool(polling), float(args.rlimit), \
+            float(args.erate1), float(args.erate2), int(args.reps), \
+            int(args.seed), bool(analytic), bool(chunked)))
+
+    def get(self, key):
+        '''
+        Returns the estimate recorded for 'key', or None if there is none.
+        '''
+        est = self.entries.get(key)
+        if est is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return est
+
+        if self.db != None:
+            row = self.db.execute("SELECT size FROM sample_sizes WHERE "\
+                "key = ?", (key,)).fetchone()
+
+            if row != None:
+                self.disk_hits += 1
+                self._remember(key, row[0])
+                return row[0]
+
+        self.misses += 1
+        return None
+
+    def put(self, key, est):
+        '''
+        Record the estimate 'est' for 'key'.
+        '''
+        if isinstance(est, np.generic):
+            est = est.item()
+
+        self._remember(key, est)
+
+        if self.db != None:
+            self.db.execute("INSERT OR REPLACE INTO sample_sizes VALUES "\
+                "(?, ?)", (key, est))
+
+    def _remember(self, key, est):
+        self.entries[key] = est
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        '''
+        Returns a dictionary of cache statistics.
+        '''
+        lookups = self.hits + self.disk_hits + self.misses
+
+        return {
+            "hits" : self.hits,
+            "disk_hits" : self.disk_hits,
+            "misses" : self.misses,
+            "hit_rate" : (self.hits + self.disk_hits)/lookups if lookups \
+                else 0,
+        }
+
+    def close(self):
+        if self.db != None:
+            self.db.close()
+            self.db = None
+
+
+def sample_size(mean, tw, tl, to, args, N, upper_bound=1, polling=False, \
+    cache=None, analytic=False, chunked=False):
+    '''
+    Estimate the sample size required to audit an assertion with tallies
+    'tw' (winner), 'tl' (loser) and 'to' (other), over N ballots, by
+    simulation. If 'analytic' is True, comparison audits are instead
+    estimated with analytic_sample_size (ballot polling audits are still
+    simulated). If 'chunked' is True, samples are simulated in chunks
+    drawn from the counts of each value in the population, rather than by
+    shuffling the whole population (see chunked_sample_size). If a
+    SampleSizeCache 'cache' is given, the estimate is looked up there
+    first, and recorded there once computed.
+    '''
+    analytic = analytic and not polling
+    chunked = chunked and not analytic
+
+    if cache != None:
+        key = SampleSizeCache.key(mean, tw, tl, to, args, N, upper_bound, \
+            polling, analytic=analytic, chunked=chunked)
+
+        est = cache.get(key)
+        if est is not None:
+            return est
+
+    if analytic:
+        est = analytic_sample_size(mean, tw, tl, to, args, N, \
+            upper_bound=upper_bound)
+    else:
+        est = simulate_sample_size(mean, tw, tl, to, args, N, \
+            upper_bound=upper_bound, polling=polling, chunked=chunked)
+
+    if cache != None:
+        cache.put(key, est)
+
+    return est
+
+
+def simulate_sample_size(mean, tw, tl, to, args, N, upper_bound=1, \
+    polling=False, chunked=False):
 
     margin = 2*mean - 1
     u = 2/(2-(margin/upper_bound))
@@ -42,6 +179,13 @@ def sample_size(mean, tw, tl, to, args, N, upper_bound=1, polling=False):
     r1 = args.erate1
     r2 = args.erate2
 
+    if chunked:
+        values, counts = population_counts(tw, tl, to, args, N, big, small, \
+            polling)
+
+        return chunked_sample_size(test, values, counts, alpha=args.rlimit, \
+            reps=args.reps, seed=args.seed)
+
     x = big*np.ones(N)
 
     if polling:
@@ -61,6 +205,272 @@ def sample_size(mean, tw, tl, to, args, N, upper_bound=1, polling=False):
         seed=args.seed, random_order=True)
 
 
+def overstatement_counts(N, r1, r2):
+    '''
+    Returns the numbers of 1-vote and 2-vote overstatements in the
+    population of N ballots constructed by simulate_sample_size for the
+    error rates 'r1' and 'r2'.
+    '''
+    s1 = int(1/r1) if r1 else 0
+    s2 = int(1/r2) if r2 else 0
+
+    n1 = -(-N // s1) if r1 else 0
+    n2 = -(-N // s2) if r2 else 0
+
+    # Ballots with both errors are recorded as 2-vote overstatements.
+    if r1 and r2:
+        n1 -= -(-N // math.lcm(s1, s2))
+
+    return n1, n2
+
+
+def population_counts(tw, tl, to, args, N, big, small, polling):
+    '''
+    Returns the distinct assorter values in the population of ballots
+    constructed by simulate_sample_size, and the number of ballots with
+    each value. 'big' and 'small' are the values of a ballot with no
+    overstatement, and with a 1-vote overstatement, in a comparison audit.
+    '''
+    if polling:
+        return np.array([0, 0.5, big]), np.array([tl, to, tw])
+
+    n1, n2 = overstatement_counts(N, args.erate1, args.erate2)
+
+    return np.array([big, small, 0]), np.array([N - n1 - n2, n1, n2])
+
+
+def chunked_sample_size(test, values, counts, alpha=0.05, reps=100, \
+    seed=None, quantile=0.5, chunk=1024):
+    '''
+    Estimate the sample size required by the NonnegMean 'test' to reject
+    its null, as NonnegMean.sample_size does for a randomly ordered
+    population, without building the population.
+
+    Input:
+        test     - NonnegMean test.
+        values   - distinct values in the population.
+        counts   - number of times each of 'values' appears in the
+                   population.
+        alpha    - risk limit.
+        reps     - number of samples to simulate.
+        seed     - seed for the random number generator.
+        quantile - quantile of the simulated sample sizes to report.
+        chunk    - number of ballots in the first chunk of each sample.
+
+    Output:
+        Returns the 'quantile' quantile of the number of ballots drawn
+        before the test rejects, over the 'reps' samples (or the size of
+        the population, for samples in which it never does).
+
+    Each sample is drawn in chunks of doubling size: the number of ballots
+    with each value in a chunk is multivariate hypergeometric, given the
+    ballots not yet drawn, and the chunk's ballots are then shuffled. After
+    each chunk, the test is applied to the sample drawn so far, and the
+    sample stops growing once it rejects. Memory is proportional to the
+    sample size rather than to the population.
+    '''
+    prng = np.random.default_rng(seed)
+
+    values = np.asarray(values, dtype=float)
+    counts = np.asarray(counts, dtype=np.int64)
+
+    N = int(counts.sum())
+
+    sams = np.full(int(reps), N)
+    for r in range(int(reps)):
+        remaining = counts.copy()
+        sample = np.zeros(0)
+
+        size = min(chunk, N)
+        while len(sample) < N:
+            drawn = prng.multivariate_hypergeometric(remaining, \
+                size - len(sample))
+            remaining -= drawn
+
+            block = np.repeat(values, drawn)
+            prng.shuffle(block)
+            sample = np.concatenate((sample, block))
+
+            p = test.test(sample)[1]
+
+            # The test rejects at the last ballot if the whole population's
+            # mean exceeds the null mean: this only applies to the last
+            # ballot of the population, not to that of a partial sample.
+            if len(sample) < N:
+                p = p[:-1]
+
+            crossed = np.flatnonzero(p <= alpha)
+            if len(crossed) > 0:
+                sams[r] = crossed[0] + 1
+                break
+
+            size = min(2*size, N)
+
+    return int(np.quantile(sams, quantile))
+
+
+def optimal_comparison_eta(u, p2=1e-4):
+    '''
+    The fixed bet of SHANGRLA's NonnegMean.optimal_comparison estimator for
+    an overstatement assorter with upper bound 'u', given a rate 'p2' of
+    2-vote overstatements.
+    '''
+    return (1 - u*(1 - p2))/(2 - 2*u) + u*(1 - p2) - 1/2
+
+
+def _hypergeom_pmfs(n, N, K, kmax, log_p0):
+    # Rows k = 0, ..., kmax of the probabilities of drawing k of the K
+    # marked ballots in n draws (a vector) without replacement from N
+    # ballots, given the log probabilities 'log_p0' of drawing none.
+    pmfs = [log_p0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for k in range(1, kmax+1):
+            step = np.log((K-k+1)*(n-k+1)/(k*(N-K-n+k)))
+            step[~(step < np.inf)] = -np.inf
+            pmfs.append(pmfs[-1] + step)
+
+    return np.exp(np.array(pmfs))
+
+
+def _within_budget(budget, cost1, cost2, p1, p2):
+    # Probability, for each draw, that the errors drawn reduce the log of
+    # the test statistic by no more than 'budget', given the costs of each
+    # error, the probabilities 'p1' of each number of 1-vote errors, and
+    # the cumulative probabilities 'p2' of the numbers of 2-vote errors.
+    prob = np.zeros(len(budget))
+    for k1 in range(len(p1)):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            k2 = np.floor((budget - k1*cost1)/cost2)
+
+        k2 = np.where(cost2 > 0, k2, np.where(budget - k1*cost1 >= 0, \
+            len(p2) - 1, -1))
+        k2 = np.nan_to_num(k2, nan=-1, posinf=len(p2)-1, neginf=-1)
+        k2 = np.clip(k2, -1, len(p2) - 1).astype(int)
+
+        within = np.take_along_axis(p2, np.maximum(k2, 0)[None,:], 0)[0]
+        prob += np.where(k2 >= 0, p1[k1]*within, 0)
+
+    return prob
+
+
+def analytic_sample_size(mean, tw, tl, to, args, N, upper_bound=1, \
+    quantile=0.5, block=4096):
+    '''
+    Estimate, without simulation, the sample size required to audit an
+    assertion in a comparison audit (as simulate_sample_size does with
+    polling=False, for the same inputs).
+
+    The population is that of simulate_sample_size: N ballots, of which
+    overstatement_counts(N, args.erate1, args.erate2) carry 1-vote and
+    2-vote overstatements. After n draws, the log of the ALPHA test
+    supermartingale (betting with the optimal_comparison estimator) is
+    approximated by its value for an error-free sample, less, for each
+    error drawn, the average over the n draws of the log-ratio of the
+    error-free term to the error's term. The numbers of errors drawn are
+    hypergeometric, giving the distribution of the log test statistic
+    after n draws directly. As it only rises by a small step with each
+    error-free draw, and falls with each error, the probability that it
+    first reaches the rejection threshold at the n'th draw follows from
+    the hitting time theorem. The estimate is the first n by which the
+    test rejects with probability 'quantile' (the simulation reports the
+    median sample size). With no errors, the estimate is exact.
+
+    Draws are considered in blocks of 'block', from the first at which an
+    error-free sample would reject.
+    '''
+    margin = 2*mean - 1
+    u = 2/(2-(margin/upper_bound))
+
+    big = 1 / (2 - margin/upper_bound) # o=0
+    small = 0.5 / (2 - margin/upper_bound) # o=0.5
+
+    n1, n2 = overstatement_counts(N, args.erate1, args.erate2)
+
+    values = np.array([big, small, 0])
+
+    eta = optimal_comparison_eta(u)
+    target = math.log(1/args.rlimit)
+
+    t = 1/2
+
+    # If the errors bring the mean of the population down to the null mean,
+    # the test will not reject before the whole population is drawn.
+    if values @ np.array([N - n1 - n2, n1, n2]) - N*t <= 1e-9*N:
+        return N
+
+    # Running totals, over the draws of preceding blocks, of the log terms
+    # of the error-free sample, of the log-ratios for each type of error,
+    # and of the log probabilities of drawing no errors of each type.
+    totals = np.zeros(5)
+
+    # Probability that the test has rejected by the end of the preceding
+    # blocks.
+    rejected = 0
+
+    for start in range(0, N, block):
+        j = np.arange(start, min(N, start + block))
+        n = j + 1
+
+        # Null mean for each draw, along the error-free sample path.
+        m = (N*t - j*big)/(N - j)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            logs = np.log((values[:,None]*eta/m + (u - values[:,None])*\
+                (u - eta)/(u - m))/u)
+
+            steps = np.array([logs[0], logs[0] - logs[1], logs[0] - logs[2],\
+                np.log((N - n1 - j)/(N - j)), np.log((N - n2 - j)/(N - j))])
+
+        steps[~np.isfinite(steps) & (np.arange(5) < 3)[:,None]] = 0
+        cumulative = totals[:,None] + np.cumsum(steps, axis=1)
+        totals = cumulative[:,-1]
+
+        budget = cumulative[0] - target
+        if not np.any(budget >= 0) and not np.any(m < 0):
+            continue
+
+        # Reduction in the log of the test statistic for each error drawn.
+        cost1 = cumulative[1]/n
+        cost2 = cumulative[2]/n
+
+        def kmax(K):
+            # Largest number of errors of a type worth considering.
+            mean_k = n[-1]*K/N
+            return int(min(K, mean_k + 10*math.sqrt(mean_k) + 10))
+
+        p1 = _hypergeom_pmfs(n, N, n1, kmax(n1), cumulative[3])
+        p2 = np.cumsum(_hypergeom_pmfs(n, N, n2, kmax(n2), cumulative[4]), \
+            axis=0)
+
+        # Probability that the test statistic is over the threshold after
+        # the n'th draw, and that it is within one error-free step of it.
+        over = _within_budget(budget, cost1, cost2, p1, p2)
+        step = np.where(np.isfinite(logs[0]), logs[0], 0)
+        near = over - _within_budget(budget - step, cost1, cost2, p1, p2)
+
+        # The hitting time theorem: the test statistic first reaches the
+        # threshold at the n'th draw with probability target/rise times
+        # that of being at the threshold then, where 'rise' is its value
+        # for an error-free sample.
+        with np.errstate(divide="ignore", invalid="ignore"):
+            first = np.where(cumulative[0] > 0, target/cumulative[0]*near, 0)
+
+        hits = rejected + np.cumsum(first)
+        rejected = hits[-1]
+
+        prob = np.maximum(hits, over)
+
+        # As in NonnegMean.alpha_mart, the null is certainly false once the
+        # adjusted null mean is negative.
+        prob[m < 0] = 1
+
+        crossed = np.flatnonzero(prob >= quantile)
+        if len(crossed) > 0:
+            return int(n[crossed[0]])
+
+    return N
+
+
 def bp_estimate(winner, loser, other, total):
     p = (winner+loser)/total
     q = (winner-loser)/(winner+loser)
@@ -15,6 +15,8 @@
 
 from raire_utils import NENAssertion, NEBAssertion, Contest, vote_for_cand,\
     ranking, load_contests_from_raire
+from ballot_store import BallotTrie, contest_ballots
+from contest_cache import load_contests
 
 from sample_estimator import *
 from raire import compute_raire_assertions
@@ -40,33 +42,22 @@ def simple_IRV_assertions(contest, cvrs, winner, runner_up):
     assertions = []
     failed_to_assert = []
 
-    ballots = [b[contest.name] for _,b in cvrs.items() if contest.name in b]
+    ballots = contest_ballots(contest, cvrs)
     others = [c for c in contest.candidates if c != winner and c != runner_up]
 
     # 1. Assertion indicating that 'winner' wins when everyone except 
     # 'winner' and 'runner_up' are eliminated.
-    w_tally_1, r_tally_1 = 0,0
+    tallies = ballots.tally(ballots.mask([winner, runner_up]))
 
+    w_tally_1 = int(tallies[ballots.index[winner]])
+    r_tally_1 = int(tallies[ballots.index[runner_up]])
 
     # 2. 'winner' NEB any candidate in others
-    min_w_2 = 0
-    max_c_w_2 = {o : 0 for o in others}
-    
-    for blt in ballots:
-        w_tally_1 += vote_for_cand(winner, others, blt)
-        r_tally_1 += vote_for_cand(runner_up, others, blt)
-
-        widx = ranking(winner, blt)
-
-        if widx == 0:
-            min_w_2 += 1
-
-        else: 
-            for c in others:
-                cidx = ranking(c, blt)
+    first, above = ballots.neb_tallies()
+    widx = ballots.index[winner]
 
-                if cidx != -1 and (widx == -1 or cidx < widx):
-                    max_c_w_2[c] += 1
+    min_w_2 = int(first[widx])
+    max_c_w_2 = {c : int(above[widx, ballots.index[c]]) for c in others}
 
     if w_tally_1 > r_tally_1:
         nen = NENAssertion(cname, winner, runner_up, others)
@@ -92,33 +83,54 @@ def simple_IRV_assertions(contest, cvrs, winner, runner_up):
     return assertions, failed_to_assert 
 
 
+def irv_tabulation(contest, cvrs):
+    """
+        Tabulate the given contest by instant runoff (see
+        BallotStore.tabulate_irv). Of the candidates tied for elimination,
+        the one listed first in contest.candidates is eliminated.
+
+        Returns a pair (order, rounds). 'order' lists the contest's
+        candidates in the order in which they are eliminated, ending with
+        the winner (the form of Contest.outcome). rounds[r] maps each
+        candidate standing at the start of round 'r' to their tally.
+    """
+    ballots = contest_ballots(contest, cvrs)
+
+    order, rounds = ballots.tabulate_irv()
+
+    cands = ballots.candidates
+
+    standing = list(range(len(cands)))
+
+    round_tallies = []
+    for c,tallies in zip(order, rounds):
+        round_tallies.append({cands[i] : int(tallies[i]) for i in standing})
+        standing.remove(c)
+
+    return [cands[c] for c in order], round_tallies
+
+
+def fill_outcome(contest, cvrs):
+    """
+        If no outcome is given for the contest, set contest.outcome to the
+        elimination order found by tabulating its ballots, provided that
+        order agrees with the reported winner. The outcome decides the
+        candidates chosen at each step of a dive in the RAIRE search (see
+        dive_candidate in raire_utils.py).
+    """
+    if contest.outcome != []:
+        return
+
+    order, _ = irv_tabulation(contest, cvrs)
+
+    if order != [] and order[-1] == contest.winner:
+        contest.outcome = order
+
+
 def sim_irv(contest, cvrs):
-    standing = [c for c in contest.candidates]
-    ballots = [b[contest.name] for _,b in cvrs.items() if contest.name in b]
-    tallies = {c : 0 for c in contest.candidates}
-
-    eliminated = []
-
-    while len(standing) > 1:
-        tallies = {c : 0 for c in standing}
-
-        for blt in ballots:
-            for c in standing:
-                if vote_for_cand(c, eliminated, blt):
-                    tallies[c] += 1
-
-        toelim = None
-        elimtally = None
-        for c in standing:
-            ctally = tallies[c]
-            if elimtally == None or (ctally < elimtally):
-                toelim = c
-                elimtally = ctally
-       
-        eliminated.append(toelim)
-        standing.remove(toelim)
-
-    return standing[0], eliminated[-1] 
+    order, _ = irv_tabulation(contest, cvrs)
+
+    return order[-1], order[-2]
         
 
 if __name__ == "__main__":    
@@ -132,24 +144,47 @@ if __name__ == "__main__":
     parser.add_argument('-reps', dest='reps', type=int, default=100)
     parser.add_argument('-agap', dest='agap', type=float, default=0)
     parser.add_argument('-bp', dest='bp', action='store_true', default=False)
+    parser.add_argument('-trie', dest='trie', action='store_true', \
+        default=False)
+
+    # SQLite database in which sample size estimates are kept across runs.
+    parser.add_argument('-sscache', dest='sscache', default=None)
+
+    # Estimate comparison audit sample sizes analytically, rather than by
+    # simulation (see analytic_sample_size in sample_estimator.py).
+    parser.add_argument('-fast', dest='fast', action='store_true')
+
+    # Simulate samples in chunks drawn from the counts of each assorter value,
+    # rather than shuffling the whole population (see chunked_sample_size).
+    parser.add_argument('-chunked', dest='chunked', action='store_true')
 
     args = parser.parse_args()
 
-    contests, cvrs = load_contests_from_raire(args.input)
+    contests, cvrs = load_contests(args.input, weighted=True)
 
 
     np.seterr(all="ignore")
 
+    sample_cache = SampleSizeCache(args.sscache)
+
     for contest in contests:
-        winner, runner_up  = sim_irv(contest, cvrs)
+        ballots = contest_ballots(contest, cvrs)
+        if args.trie:
+            ballots = BallotTrie(ballots)
+
+        winner, runner_up  = sim_irv(contest, ballots)
+
+        # Dives in the RAIRE search follow the tabulated elimination order
+        # if the data file does not give one.
+        fill_outcome(contest, ballots)
 
         N = contest.tot_ballots
 
         # Create test for estimating sample sizes (use default settings)
-        assertions, failures = simple_IRV_assertions(contest, cvrs, winner, \
-            runner_up)
+        assertions, failures = simple_IRV_assertions(contest, ballots, \
+            winner, runner_up)
 
-        raire_audit = compute_raire_assertions(contest, cvrs, winner, 
+        raire_audit = compute_raire_assertions(contest, ballots, winner, 
             bp_estimate if args.bp else cp_estimate, False, agap=args.agap)
 
         raire_est = 0
@@ -160,7 +195,9 @@ if __name__ == "__main__":
             amean = (asrtn.votes_for_winner + 0.5*tother)/N
 
             est = sample_size(amean, asrtn.votes_for_winner, \
-                asrtn.votes_for_loser, tother, args, N, polling=args.bp)
+                asrtn.votes_for_loser, tother, args, N, polling=args.bp, \
+                cache=sample_cache, analytic=args.fast, \
+                chunked=args.chunked)
 
             raire_est = max(est, raire_est)
 
@@ -180,7 +217,9 @@ if __name__ == "__main__":
                 amean = (asrtn.votes_for_winner + 0.5*tother)/N
 
                 est = sample_size(amean, asrtn.votes_for_winner, \
-                    asrtn.votes_for_loser, tother, args, N, polling=args.bp)
+                    asrtn.votes_for_loser, tother, args, N, polling=args.bp, \
+                cache=sample_cache, analytic=args.fast, \
+                chunked=args.chunked)
 
                 max_cost = max(est, max_cost)
 
@@ -208,3 +247,8 @@ if __name__ == "__main__":
 
         
                  
+
+    if args.sscache != None:
+        print("Sample size cache: {}".format(sample_cache.stats()))
+
+    sample_cache.close()